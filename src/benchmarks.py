@@ -0,0 +1,190 @@
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from model import Drosophila, FoodCup, Experiment
+from ensemble import weekly_food_schedule
+from instrument import PHASES
+
+def _cup_with_eggs(occupants, engine="objects"):
+    """Experiment whose whole population is `occupants` eggs on one cup."""
+    experiment = Experiment(pop_size=0, engine=engine)
+    cup = FoodCup(creation_day=0, cup_id=0)
+    if engine == "arrays":
+        ids = Drosophila.reserve_ids(occupants)
+        experiment.population.add(ids, bday=0, age=0, loci=0, trait=0.5, cup=0)
+        cup.hold_many(ids.tolist())
+        return experiment, cup
+    for _ in range(occupants):
+        fly = Drosophila(bday=0, genotype={"sex": 0, "transgenic-lethal": 0, "receptivity-vigor": 0.5})
+        experiment.add_fly(fly)
+        cup.hold(fly.id)
+    return experiment, cup
+
+def _linear_scan_cull(population, flies_ID):
+    """Cup culling before the ID index: one population scan per occupant."""
+    for fly_id in flies_ID:
+        for fly in population:
+            if (fly.id == fly_id and fly.age < 10):
+                fly.alive = False
+                break
+
+def bench_cup_retirement(occupants, sample=100):
+    ''' Time the retirement of a cup holding `occupants` eggs.
+    The former linear scan is quadratic, so it is timed on `sample`
+    randomly chosen occupants and scaled to the whole cup.'''
+    experiment, cup = _cup_with_eggs(occupants)
+    sampled = list(np.random.choice(cup.flies_ID, size=min(sample, occupants), replace=False))
+    start = time.perf_counter()
+    _linear_scan_cull(experiment.population, sampled)
+    linear = (time.perf_counter() - start) * occupants / len(sampled)
+
+    start = time.perf_counter()
+    experiment.cull_cup(cup)
+    indexed = time.perf_counter() - start
+
+    experiment, cup = _cup_with_eggs(occupants, engine="arrays")
+    start = time.perf_counter()
+    experiment.cull_cup(cup)
+    arrays = time.perf_counter() - start
+    return {"occupants": occupants,
+            "linear_scan_s": linear,
+            "indexed_s": indexed,
+            "arrays_s": arrays,
+            "speedup": linear / indexed}
+
+def bench_memory_per_fly(n_flies=20_000):
+    ''' Bytes per mated adult female, Drosophila objects (genotype dict,
+    spermatheque copy of the male dict) against the packed FlyArrays.'''
+    male = Drosophila(bday=0, age=12, genotype={"sex": 0, "transgenic-lethal": 0, "receptivity-vigor": 0.5})
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    flies = []
+    for _ in range(n_flies):
+        fly = Drosophila(bday=0, age=12, genotype={"sex": 1, "transgenic-lethal": 0,
+                                                   "receptivity-vigor": np.random.random()})
+        fly.cross(Drosophila(bday=0, age=12, genotype=dict(male.genotype)))
+        flies.append(fly)
+    objects = (tracemalloc.get_traced_memory()[0] - before) / n_flies
+    tracemalloc.stop()
+    del flies
+    experiment = Experiment(pop_size=n_flies, engine="arrays")
+    population = experiment.population
+    arrays = population.capacity * population.nbytes_per_fly / len(population)
+    return {"flies": n_flies,
+            "objects_bytes": objects,
+            "arrays_bytes": arrays,
+            "arrays_bytes_packed": population.nbytes_per_fly}
+
+def bench_run(engine, pop_size, days=(30, 154, 300), memory=True, seed=0, **params):
+    ''' Time one experiment phase by phase (Experiment instrumentation),
+    reporting at each run length in days (one run to the longest length,
+    cumulative figures at the shorter ones). flies_per_s is fly-days
+    (living flies summed over the days) per second of wall time. With
+    memory, the run is repeated under tracemalloc for the peak traced
+    memory, which would distort timings.'''
+    days = sorted(days)
+    params = dict(weekly_food_schedule(days[-1]), **params)
+    experiment = Experiment(pop_size=pop_size, engine=engine, seed=seed, instrument=True, **params)
+    timings = dict.fromkeys(PHASES, 0.0)
+    fly_days = 0
+    results = []
+    for day in range(1, days[-1] + 1):
+        experiment.update_day()
+        record = experiment.instruments.records[-1]
+        for phase in PHASES:
+            timings[phase] += record[phase + "_s"]
+        fly_days += len(experiment.population)
+        if day in days:
+            wall = sum(timings.values())
+            results.append({"engine": engine,
+                            "pop_size": pop_size,
+                            "days": day,
+                            "wall_s": wall,
+                            "phases_s": dict(timings),
+                            "fly_days": fly_days,
+                            "flies_per_s": fly_days / wall if wall else None,
+                            "final_adults": experiment.daily_data[-1][1]})
+    if memory:
+        tracemalloc.start()
+        experiment = Experiment(pop_size=pop_size, engine=engine, seed=seed, **params)
+        peaks = {}
+        for day in range(1, days[-1] + 1):
+            experiment.update_day()
+            if day in days:
+                peaks[day] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        for result in results:
+            result["peak_bytes"] = peaks[result["days"]]
+    return results
+
+def bench_suite(engines=("objects", "arrays", "cohort"), sizes=(300, 3_000, 30_000),
+                days=(30, 154, 300), memory=True, seed=0, output=None):
+    ''' Scaling report over engines x founding population sizes x run
+    lengths, written as JSON to output when given.'''
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": sys.version.split()[0],
+              "numpy": np.__version__,
+              "machine": platform.machine(),
+              "results": []}
+    for engine in engines:
+        for pop_size in sizes:
+            report["results"].extend(bench_run(engine, pop_size, days, memory=memory, seed=seed))
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
+
+def compare_reports(baseline, report, tolerance=0.2):
+    ''' Runs of report slower than the same (engine, pop_size, days) run of
+    baseline by more than tolerance. Either argument can be a JSON path.
+    Returns a list of (key, baseline wall_s, new wall_s).'''
+    reports = []
+    for item in (baseline, report):
+        if isinstance(item, str):
+            with open(item) as file:
+                item = json.load(file)
+        reports.append({(r["engine"], r["pop_size"], r["days"]): r for r in item["results"]})
+    old, new = reports
+    regressions = []
+    for key, result in new.items():
+        if key in old and result["wall_s"] > old[key]["wall_s"] * (1 + tolerance):
+            regressions.append((key, old[key]["wall_s"], result["wall_s"]))
+    return regressions
+
+def print_report(report):
+    print(f"{'engine':>8} {'flies':>6} {'days':>5} {'wall s':>8} {'flies/s':>10} {'peak MB':>8}  slowest phases")
+    for r in report["results"]:
+        slowest = sorted(r["phases_s"].items(), key=lambda item: -item[1])[:3]
+        phases = ", ".join(f"{name} {seconds / r['wall_s']:.0%}" for name, seconds in slowest)
+        peak = f"{r['peak_bytes'] / 1e6:8.1f}" if "peak_bytes" in r else f"{'-':>8}"
+        print(f"{r['engine']:>8} {r['pop_size']:>6} {r['days']:>5} {r['wall_s']:8.2f} "
+              f"{r['flies_per_s']:10.0f} {peak}  {phases}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulation core.")
+    parser.add_argument("--engines", nargs="+", default=["objects", "arrays", "cohort"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[300, 3_000, 30_000])
+    parser.add_argument("--days", nargs="+", type=int, default=[30, 154, 300])
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write the scaling report to this JSON file")
+    parser.add_argument("--baseline", help="JSON report to check for regressions")
+    parser.add_argument("--micro", action="store_true", help="also run the cup retirement and memory benchmarks")
+    args = parser.parse_args()
+    report = bench_suite(args.engines, args.sizes, args.days, memory=not args.no_memory, output=args.output)
+    print_report(report)
+    if args.baseline:
+        for key, old, new in compare_reports(args.baseline, report):
+            print(f"regression {key}: {old:.2f} s -> {new:.2f} s")
+    if args.micro:
+        for occupants in (10_000, 100_000):
+            result = bench_cup_retirement(occupants)
+            print(f"{occupants:>7} occupants: linear scan ~{result['linear_scan_s']:.2f} s (extrapolated), "
+                  f"index {result['indexed_s'] * 1e3:.1f} ms, arrays {result['arrays_s'] * 1e3:.2f} ms "
+                  f"({result['speedup']:.0f}x)")
+        memory = bench_memory_per_fly()
+        print(f"memory per fly: objects {memory['objects_bytes']:.0f} B, "
+              f"arrays {memory['arrays_bytes_packed']} B ({memory['arrays_bytes']:.0f} B with spare capacity)")
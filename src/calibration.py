@@ -0,0 +1,160 @@
+import json
+import multiprocessing
+import os
+import numpy as np
+import census_data
+from ensemble import collect_ensemble
+
+# fitted parameters and their bounds (same as minimize_fit.py)
+PARAMETERS = ("p_daily", "pop_size", "clutch_size", "consumption_rate")
+BOUNDS = [(0.01, 0.5),
+          (50, 300),
+          (1, 5),
+          (0.000001, 0.0001)]
+INTEGER_PARAMETERS = ("pop_size", "clutch_size")
+
+def to_params(x):
+    """Parameter vector -> Experiment keyword arguments."""
+    params = dict(zip(PARAMETERS, (float(value) for value in x)))
+    for name in INTEGER_PARAMETERS:
+        params[name] = int(round(params[name]))
+    return params
+
+class Calibration:
+    ''' Scores batches of candidate parameter vectors against the census.
+    Each candidate is simulated `replicates` times with common random
+    numbers (replicate r uses the same seed for every candidate), the
+    weekly output is averaged over replicates and scored against all
+    cages at once with a census_data loss ("mse", "poisson" or "negbin",
+    loss_args e.g. {"dispersion": 5}), optionally weighting treatments,
+    so one score fits the eight cages jointly. A [cage, week] data array
+    replaces the census counts.'''
+
+    def __init__(self, data=None, replicates=8, days=154, seed=0, processes=None,
+                 engine="arrays", bounds=BOUNDS, loss="mse", loss_args=None,
+                 treatment_weights=None, census=None):
+        self.census = census_data.load() if census is None else census
+        if data is None:
+            self.data = self.census.census
+            self.weights = self.census.weights(treatment_weights)
+        else:
+            self.data = np.atleast_2d(np.asarray(data, dtype=float))
+            self.weights = None
+        self.loss = census_data.LOSSES[loss]
+        self.loss_args = loss_args or {}
+        self.replicates = replicates
+        self.days = days
+        self.seed = seed
+        self.engine = engine
+        self.bounds = np.array(bounds, dtype=float)
+        self.evaluations = 0
+        self._pool = None if processes == 1 else multiprocessing.Pool(processes)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def clip(self, candidates):
+        return np.clip(candidates, self.bounds[:, 0], self.bounds[:, 1])
+
+    def simulate(self, candidates):
+        """Weekly model output for a batch: array [candidate, replicate, week]."""
+        param_sets = [dict(to_params(x), engine=self.engine) for x in self.clip(candidates)]
+        fits = collect_ensemble(param_sets, self.replicates, self.days, self.seed,
+                                processes=1, pool=self._pool, common_random_numbers=True)
+        return np.stack(fits)
+
+    def score(self, candidates):
+        """Joint loss of every candidate in the batch (lower is better)."""
+        candidates = np.atleast_2d(candidates)
+        # [candidate, 1, week], the same expectation for every cage
+        model = self.simulate(candidates).mean(axis=1)[:, None, :]
+        self.evaluations += len(candidates) * self.replicates
+        return self.loss(model, self.data, weights=self.weights, **self.loss_args)
+
+def _save_checkpoint(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, path)
+
+def _load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+def cross_entropy_fit(calibration, generations=20, batch_size=32, elite_fraction=0.25,
+                      seed=0, checkpoint=None):
+    ''' Population-based fit: sample a batch from a Gaussian over the scaled
+    parameter box, keep the elite, refit mean/std, repeat.
+    When `checkpoint` is a path, the search state is written there after
+    every generation and a later call with the same path resumes from it.'''
+    low, high = calibration.bounds[:, 0], calibration.bounds[:, 1]
+    state = _load_checkpoint(checkpoint)
+    if state is None:
+        state = {"generation": 0,
+                 "mean": [0.5] * len(low),
+                 "std": [0.3] * len(low),
+                 "best_x": None,
+                 "best_loss": None,
+                 "history": [],
+                 "rng": np.random.default_rng(seed).bit_generator.state}
+    rng = np.random.default_rng()
+    rng.bit_generator.state = state["rng"]
+    n_elite = max(2, int(batch_size * elite_fraction))
+
+    while state["generation"] < generations:
+        mean, std = np.array(state["mean"]), np.array(state["std"])
+        unit = np.clip(rng.normal(mean, std, size=(batch_size, len(mean))), 0, 1)
+        candidates = low + unit * (high - low)
+        losses = calibration.score(candidates)
+        elite = np.argsort(losses)[:n_elite]
+        state["mean"] = unit[elite].mean(axis=0).tolist()
+        state["std"] = np.maximum(unit[elite].std(axis=0), 0.01).tolist()
+        if state["best_loss"] is None or losses[elite[0]] < state["best_loss"]:
+            state["best_loss"] = float(losses[elite[0]])
+            state["best_x"] = candidates[elite[0]].tolist()
+        state["generation"] += 1
+        state["history"].append({"generation": state["generation"],
+                                 "best_loss": state["best_loss"],
+                                 "batch_mean_loss": float(losses.mean())})
+        state["rng"] = rng.bit_generator.state
+        if checkpoint is not None:
+            _save_checkpoint(checkpoint, state)
+    return state
+
+def nelder_mead_fit(calibration, x0, maxiter=200, checkpoint=None):
+    ''' Derivative-free local fit with scipy's Nelder-Mead. Common random
+    numbers make the objective deterministic, which the simplex needs.
+    The best point is checkpointed and used as x0 when resuming.'''
+    from scipy.optimize import minimize
+    state = _load_checkpoint(checkpoint)
+    if state is not None:
+        x0 = state["best_x"]
+    state = {"best_x": list(x0), "best_loss": None}
+    low, high = calibration.bounds[:, 0], calibration.bounds[:, 1]
+
+    # optimize on the unit box so the simplex steps are comparable
+    def objective(unit):
+        loss = float(calibration.score(low + unit * (high - low))[0])
+        if state["best_loss"] is None or loss < state["best_loss"]:
+            state["best_loss"] = loss
+            state["best_x"] = (low + np.clip(unit, 0, 1) * (high - low)).tolist()
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, state)
+        return loss
+
+    unit0 = (np.asarray(x0, dtype=float) - low) / (high - low)
+    result = minimize(objective, unit0, method="Nelder-Mead",
+                      bounds=[(0, 1)] * len(low), options={"maxiter": maxiter})
+    state["result"] = {"success": bool(result.success), "nit": int(result.nit)}
+    return state
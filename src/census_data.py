@@ -0,0 +1,128 @@
+import csv
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+from scipy.special import gammaln
+
+CENSUS_CSV = Path(__file__).resolve().parent.parent / "data" / "Experimental evolution-DSPR-census.csv"
+
+# numeric columns of the census table, each loaded as a [cage, week] array
+COLUMNS = ("census",
+           "count.1", "count.2", "count.3",
+           "mass.1", "mass.2", "mass.3", "mass.t",
+           "unit.1", "unit.2", "unit.3", "unit.mean", "unit.sd")
+
+class CensusData:
+    ''' The DSPR cage census as [cage, week] arrays.
+    columns holds every numeric column of the CSV (census counts, sample
+    counts, masses and unit masses), treatment the treatment code of each
+    cage and week as an index into treatments. Weeks a cage was not
+    censused are NaN.'''
+
+    def __init__(self, cages, weeks, populations, treatments, treatment, columns):
+        self.cages = cages              # cage names, row order
+        self.weeks = weeks              # week numbers, column order
+        self.populations = populations  # founding population of each cage
+        self.treatments = treatments    # treatment names
+        self.treatment = treatment      # [cage, week] index into treatments, -1 if missing
+        self.columns = columns
+
+    @property
+    def census(self):
+        return self.columns["census"]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def weights(self, treatment_weights=None):
+        ''' [cage, week] weights from {treatment name: weight}, treatments
+        not listed weigh 1; missing weeks weigh 0.'''
+        table = np.ones(len(self.treatments) + 1)
+        table[-1] = 0.0
+        for name, weight in (treatment_weights or {}).items():
+            table[self.treatments.index(name)] = weight
+        return table[self.treatment]
+
+@lru_cache(maxsize=None)
+def load(csv_path=CENSUS_CSV):
+    ''' Read the census CSV once per process (cached) into CensusData.'''
+    with open(csv_path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    cages = sorted({row["cage"] for row in rows})
+    weeks = sorted({int(row["week"]) for row in rows})
+    treatments = sorted({row["treat"] for row in rows})
+    cage_index = {cage: i for i, cage in enumerate(cages)}
+    week_index = {week: j for j, week in enumerate(weeks)}
+    shape = (len(cages), len(weeks))
+    columns = {name: np.full(shape, np.nan) for name in COLUMNS}
+    treatment = np.full(shape, -1, dtype=np.int64)
+    populations = [""] * len(cages)
+    for row in rows:
+        i, j = cage_index[row["cage"]], week_index[int(row["week"])]
+        for name in COLUMNS:
+            columns[name][i, j] = float(row[name])
+        treatment[i, j] = treatments.index(row["treat"])
+        populations[i] = row["pop"]
+    for column in columns.values():
+        column.flags.writeable = False
+    treatment.flags.writeable = False
+    return CensusData(cages, np.array(weeks), populations, treatments, treatment, columns)
+
+def _align(model, data, weights):
+    ''' Trim model [..., cage or 1, week] and data [cage, week] to common
+    weeks; missing data weigh 0.'''
+    model = np.asarray(model, dtype=float)
+    data = np.asarray(data, dtype=float)
+    weeks = min(model.shape[-1], data.shape[-1])
+    model, data = model[..., :weeks], data[..., :weeks]
+    weights = np.ones(data.shape) if weights is None else np.asarray(weights, dtype=float)[..., :weeks]
+    missing = np.isnan(data)
+    weights = np.where(missing, 0.0, weights)
+    data = np.where(missing, 0.0, data)
+    return model, data, weights
+
+def mse(model, data, weights=None):
+    ''' Weighted mean squared error over the last two axes (cage, week),
+    any leading axes (candidates, replicates) are kept.'''
+    model, data, weights = _align(model, data, weights)
+    return (weights * (model - data) ** 2).sum(axis=(-2, -1)) / weights.sum()
+
+def poisson_nll(model, data, weights=None, floor=1e-9):
+    ''' Weighted Poisson negative log-likelihood of the census given the
+    model expectation, summed over (cage, week).'''
+    model, data, weights = _align(model, data, weights)
+    mu = np.maximum(model, floor)
+    nll = mu - data * np.log(mu) + gammaln(data + 1)
+    return (weights * nll).sum(axis=(-2, -1))
+
+def negbin_nll(model, data, dispersion, weights=None, floor=1e-9):
+    ''' Weighted negative binomial negative log-likelihood, mean the model
+    expectation and size `dispersion` (variance mu + mu^2 / dispersion;
+    a scalar or one value per cage), summed over (cage, week).'''
+    model, data, weights = _align(model, data, weights)
+    mu = np.maximum(model, floor)
+    k = np.asarray(dispersion, dtype=float)
+    if k.ndim == 1:
+        k = k[:, None]
+    k = np.broadcast_to(k, data.shape)
+    constant = gammaln(data + k) - gammaln(k) - gammaln(data + 1)
+    loglik = constant + k * np.log(k / (k + mu)) + data * np.log(mu / (k + mu))
+    return -(weights * loglik).sum(axis=(-2, -1))
+
+LOSSES = {"mse": mse, "poisson": poisson_nll, "negbin": negbin_nll}
+
+def score(weekly, census=None, loss="mse", treatment_weights=None, per_cage=False,
+          column="census", **loss_args):
+    ''' Score a whole ensemble's weekly output against every cage in one call.
+    weekly: [..., replicate, week] model output compared with all cages,
+    or with per_cage [..., replicate, cage, week]; replicates are averaged
+    into the model expectation. Returns one loss per leading index
+    (e.g. per candidate).'''
+    census = load() if census is None else census
+    weekly = np.asarray(weekly, dtype=float)
+    data = census[column]
+    if per_cage:
+        expected = weekly.mean(axis=-3)
+    else:
+        expected = weekly.mean(axis=-2)[..., None, :]
+    return LOSSES[loss](expected, data, weights=census.weights(treatment_weights), **loss_args)
@@ -0,0 +1,229 @@
+import numpy as np
+from population import PopulationCounts, STAGES, EGG, LARVA, IMMATURE, ADULT
+
+# pre-adults are kept per age in days (after the daily update), flies
+# reaching ADULT_AGE leave the cup and join the adult pool
+ADULT_AGE = 13
+# stage of a pre-adult by age, as reached through Drosophila._transition_stage
+AGE_STAGES = np.array([EGG] * 2 + [LARVA] * 9 + [IMMATURE] * 2, dtype=np.int8)
+# pre-adults younger than this are culled with their cup, older ones
+# count as adult deaths (Experiment.collect_dead)
+CULL_AGE = 10
+
+class FlyCohorts:
+    ''' Cohort-aggregated population: fly counts per class instead of flies.
+    Pre-adults are counted per food cup as [age, sex, transgenic-lethal,
+    vigor bin]; adults are pooled over age (mortality does not depend on
+    it) as males [transgenic-lethal, vigor bin] and females
+    [transgenic-lethal, vigor bin, sperm], where sperm 0 is unmated and
+    1 + lethal * bins + bin is the class of the male whose sperm is used.
+    Mortality, lethality, mating, clutch sizes, inheritance and cup choice
+    are binomial/multinomial draws over the classes, so a day costs the
+    same for 300 or 100k flies. Individual identities, parents and exact
+    receptivity-vigor values are not kept, alleles are taken as uniform
+    within their bin.'''
+
+    def __init__(self, vigor_bins=10):
+        self.bins = vigor_bins
+        self.n_sperm = 1 + 2 * vigor_bins
+        self.cups = {}          # cup_id -> pre-adult counts [age, sex, lethal, bin]
+        self.males = np.zeros((2, vigor_bins), dtype=np.int64)
+        self.females = np.zeros((2, vigor_bins, self.n_sperm), dtype=np.int64)
+        self.dead_adults = 0    # adult deaths since the last collect_dead
+
+    def __len__(self):
+        return self.counts.total()
+
+    def vigor_bin(self, trait):
+        return np.minimum((np.asarray(trait) * self.bins).astype(np.int64), self.bins - 1)
+
+    def mating_odds(self, mating_threshold):
+        ''' [female bin, male bin] probability that receptivity plus vigor
+        exceeds the threshold for alleles uniform within their bins. In
+        units of the bin width the sum is i + j plus a triangular
+        variable on [0, 2].'''
+        bins = np.arange(self.bins)
+        s = mating_threshold * self.bins - bins[:, None] - bins[None, :]
+        below = np.where(s < 1, np.clip(s, 0, 1) ** 2 / 2, 1 - np.clip(2 - s, 0, 1) ** 2 / 2)
+        return 1 - below
+
+    def _cup(self, cup_id):
+        if cup_id not in self.cups:
+            self.cups[cup_id] = np.zeros((ADULT_AGE, 2, 2, self.bins), dtype=np.int64)
+        return self.cups[cup_id]
+
+    @property
+    def counts(self):
+        ''' PopulationCounts of the living population, built from the classes.'''
+        counts = PopulationCounts()
+        for cup in self.cups.values():
+            by_age = cup.sum(axis=3)
+            for stage in (EGG, LARVA, IMMATURE):
+                counts.counts[stage] += by_age[AGE_STAGES == stage].sum(axis=0)
+        counts.counts[ADULT, 0] = self.males.sum(axis=1)
+        counts.counts[ADULT, 1] = self.females.sum(axis=(1, 2))
+        return counts
+
+    def vigor_table(self):
+        ''' Living flies by [stage, sex, transgenic-lethal, vigor bin].'''
+        table = np.zeros((len(STAGES), 2, 2, self.bins), dtype=np.int64)
+        for cup in self.cups.values():
+            for stage in (EGG, LARVA, IMMATURE):
+                table[stage] += cup[AGE_STAGES == stage].sum(axis=0)
+        table[ADULT, 0] = self.males
+        table[ADULT, 1] = self.females.sum(axis=2)
+        return table
+
+    def census(self):
+        ''' Adult totals: (adults, males, females).'''
+        return self.counts.census()
+
+    def add_adults(self, sex, lethal, trait):
+        ''' Add adult flies given one sex and lethal status (scalars or
+        arrays) and their receptivity-vigor alleles.'''
+        trait = np.atleast_1d(trait)
+        sex = np.broadcast_to(sex, trait.shape)
+        lethal = np.broadcast_to(lethal, trait.shape)
+        cells = np.bincount((sex * 2 + lethal) * self.bins + self.vigor_bin(trait),
+                            minlength=4 * self.bins).reshape(2, 2, self.bins)
+        self.males += cells[0]
+        self.females[:, :, 0] += cells[1]
+
+    def update(self, rng=None):
+        ''' FlyArrays.update over the classes: lethality of new eggs,
+        aging by one day, emergence of adults.'''
+        rng = np.random.default_rng() if rng is None else rng
+        for cup_id, cup in list(self.cups.items()):
+            # transgenic-lethal embryos, 97% penetrance
+            cup[0, :, 1] -= rng.binomial(cup[0, :, 1], 0.97)
+            emerged = cup[-1]
+            self.males += emerged[0]
+            self.females[:, :, 0] += emerged[1]
+            cup[1:] = cup[:-1].copy()
+            cup[0] = 0
+            if not cup.any():
+                del self.cups[cup_id]
+
+    def mortality_round(self, p_daily, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        for cup in self.cups.values():
+            dead = rng.binomial(cup, p_daily)
+            cup -= dead
+            self.dead_adults += int(dead[CULL_AGE:].sum())
+        for adults in (self.males, self.females):
+            dead = rng.binomial(adults, p_daily)
+            adults -= dead
+            self.dead_adults += int(dead.sum())
+
+    def cup_occupancy(self):
+        """Living pre-adults per food cup, {cup_id: count}."""
+        return {cup_id: int(cup.sum()) for cup_id, cup in self.cups.items()}
+
+    def cull_cup(self, cup_id):
+        ''' Kill the pre-adults held on a retired food cup. Returns the number culled.'''
+        if cup_id not in self.cups:
+            return 0
+        culled = int(self.cups[cup_id][:CULL_AGE].sum())
+        self.cups[cup_id][:CULL_AGE] = 0
+        return culled
+
+    def collect_dead(self):
+        ''' Adult deaths since the last call.'''
+        dead, self.dead_adults = self.dead_adults, 0
+        return dead
+
+    def cross(self, mating_threshold=1.0, multiple_mating=False, last_male_precedence=True, rng=None):
+        ''' One day of mating, see draw_matings: the females of each class
+        meet males spread multinomially over the male classes, and each
+        pair mates with the mating_odds of their two bins.
+        Returns the number of successful matings.'''
+        rng = np.random.default_rng() if rng is None else rng
+        n_males = self.males.sum()
+        candidates = self.females if multiple_mating else self.females[:, :, :1]
+        if n_males == 0 or candidates.sum() == 0:
+            return 0
+        bins = self.bins
+        met = rng.multinomial(candidates, self.males.ravel() / n_males)
+        # [female lethal, female bin, sperm, male lethal, male bin]
+        met = met.reshape(candidates.shape + (2, bins))
+        odds = self.mating_odds(mating_threshold)
+        mated = rng.binomial(met, odds[None, :, None, None, :])
+        if not last_male_precedence:
+            # only unmated females take the sperm of this mate
+            new_sperm = mated[:, :, 0].reshape(2, bins, 2 * bins)
+            self.females[:, :, 0] -= new_sperm.sum(axis=2)
+        else:
+            new_sperm = mated.sum(axis=2).reshape(2, bins, 2 * bins)
+            self.females[:, :, :candidates.shape[2]] -= mated.sum(axis=(3, 4))
+        self.females[:, :, 1:] += new_sperm
+        return int(mated.sum())
+
+    def lay_eggs(self, clutch_size, cup_ids, rng=None, genetics_rng=None, cups_rng=None):
+        ''' One day of oviposition, see draw_clutches: every female lays a
+        binomial clutch; eggs of mated females carry the father's lethal
+        status and one parental vigor bin, eggs of unmated females are
+        wildtype. Eggs are spread over the cups in cup_ids.
+        Returns the number of eggs laid on each cup.'''
+        rng = np.random.default_rng() if rng is None else rng
+        genetics_rng = rng if genetics_rng is None else genetics_rng
+        cups_rng = rng if cups_rng is None else cups_rng
+        bins = self.bins
+        eggs = rng.binomial(self.females * clutch_size, 0.5)
+        # [female lethal, female bin, male lethal, male bin]
+        sired = eggs[:, :, 1:].reshape(2, bins, 2, bins)
+        maternal = genetics_rng.binomial(sired, 0.5)
+        offspring = maternal.sum(axis=(0, 3)).T + (sired - maternal).sum(axis=(0, 1))
+        offspring[0] += genetics_rng.multinomial(eggs[:, :, 0].sum(), np.full(bins, 1 / bins))
+        daughters = genetics_rng.binomial(offspring, 0.5)
+        offspring = np.stack([offspring - daughters, daughters])
+        # [sex, lethal, bin, cup]
+        per_cup = cups_rng.multinomial(offspring, np.full(len(cup_ids), 1 / len(cup_ids)))
+        for index, cup_id in enumerate(cup_ids):
+            self._cup(cup_id)[0] += per_cup[..., index]
+        return per_cup.sum(axis=(0, 1, 2))
+
+
+def compare_engines(days=60, replicates=30, engines=("arrays", "cohort"), **params):
+    ''' Statistical equivalence check of the cohort engine against the
+    individual-based model: runs `replicates` seeded experiments per
+    engine and compares the daily adult census and adult mortality.
+    Returns per-day mean and standard error for each engine plus the
+    largest two-sample z score per column; |z| of about 3 or less over
+    all days is what equivalent engines give.'''
+    from model import Experiment
+    from ensemble import weekly_food_schedule
+    params.setdefault("pop_size", 300)
+    if "food_init_dates" not in params:
+        params.update(weekly_food_schedule(days))
+    seeds = np.random.SeedSequence(0).spawn(replicates)
+    runs = {}
+    for engine in engines:
+        data = []
+        for seed in seeds:
+            experiment = Experiment(engine=engine, seed=seed, **params)
+            for _ in range(days):
+                experiment.update_day()
+            data.append(experiment.daily_data)
+        runs[engine] = np.array(data, dtype=float)[:, :, 1:]
+    summary = {engine: (runs[engine].mean(axis=0), runs[engine].std(axis=0, ddof=1) / np.sqrt(replicates))
+               for engine in engines}
+    (mean_a, se_a), (mean_b, se_b) = summary[engines[0]], summary[engines[1]]
+    se = np.sqrt(se_a ** 2 + se_b ** 2)
+    z = np.divide(mean_a - mean_b, se, out=np.zeros_like(se), where=se > 0)
+    columns = ("adults", "males", "females", "adult_mortality")
+    return {"summary": summary,
+            "max_z": {name: float(np.abs(z[:, i]).max()) for i, name in enumerate(columns)}}
+
+if __name__ == "__main__":
+    import time
+    result = compare_engines()
+    for column, z in result["max_z"].items():
+        print(f"{column:>16}: max |z| {z:.2f}")
+    from model import Experiment
+    for pop_size in (300, 100_000):
+        experiment = Experiment(pop_size=pop_size, engine="cohort", seed=1,
+                                food_init_dates=list(range(0, 61, 7)), food_shelf_life=[14] * 9)
+        start = time.perf_counter()
+        for _ in range(60):
+            experiment.update_day()
+        print(f"cohort engine, {pop_size:>6} founders: {time.perf_counter() - start:.2f} s for 60 days")
@@ -0,0 +1,211 @@
+import numpy as np
+from calibration import BOUNDS, PARAMETERS
+
+def latin_hypercube(n, dims, rng=None):
+    ''' n points in the unit cube, one per row and column stratum.'''
+    rng = np.random.default_rng() if rng is None else rng
+    strata = np.argsort(rng.random((dims, n)), axis=1).T
+    return (strata + rng.random((n, dims))) / n
+
+class GaussianProcess:
+    ''' Multi-output Gaussian process on the unit box: a squared-exponential
+    kernel with one length scale per input dimension, shared by every
+    output (e.g. the weeks of a census), and a per-point noise variance.
+    Outputs are standardized; length scales maximize the log marginal
+    likelihood by coordinate search, so numpy is all it needs.'''
+
+    def __init__(self, lengthscales=None, jitter=1e-6):
+        self.lengthscales = None if lengthscales is None else np.asarray(lengthscales, dtype=float)
+        self.jitter = jitter
+
+    def _kernel(self, a, b, lengthscales):
+        d = (a[:, None, :] - b[None, :, :]) / lengthscales
+        return np.exp(-0.5 * np.einsum("ijk,ijk->ij", d, d))
+
+    def _log_likelihood(self, lengthscales):
+        K = self._kernel(self.X, self.X, lengthscales) + np.diag(self.noise + self.jitter)
+        try:
+            L = np.linalg.cholesky(K)
+        except np.linalg.LinAlgError:
+            return -np.inf
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, self.Y))
+        return -0.5 * np.sum(self.Y * alpha) - self.Y.shape[1] * np.log(np.diag(L)).sum()
+
+    def fit(self, X, Y, noise=None, sweeps=3):
+        ''' X [point, dim] in the unit box, Y [point, output], noise the
+        variance of each Y row (in Y units, averaged over outputs).'''
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        self.X = X
+        self.y_mean = Y.mean(axis=0)
+        self.y_std = np.where(Y.std(axis=0) > 0, Y.std(axis=0), 1.0)
+        self.Y = (Y - self.y_mean) / self.y_std
+        if noise is None:
+            self.noise = np.zeros(len(X))
+        else:
+            self.noise = np.asarray(noise, dtype=float) / np.mean(self.y_std ** 2)
+        lengthscales = np.full(X.shape[1], 0.3) if self.lengthscales is None else self.lengthscales.copy()
+        best = self._log_likelihood(lengthscales)
+        for _ in range(sweeps):
+            for dim in range(X.shape[1]):
+                for factor in (0.25, 0.5, 2.0, 4.0):
+                    trial = lengthscales.copy()
+                    trial[dim] = np.clip(trial[dim] * factor, 0.02, 20.0)
+                    value = self._log_likelihood(trial)
+                    if value > best:
+                        best, lengthscales = value, trial
+        self.lengthscales = lengthscales
+        self.log_likelihood = best
+        K = self._kernel(X, X, lengthscales) + np.diag(self.noise + self.jitter)
+        L = np.linalg.cholesky(K)
+        self._alpha = np.linalg.solve(L.T, np.linalg.solve(L, self.Y))
+        L_inv = np.linalg.solve(L, np.eye(len(X)))
+        self._K_inv = L_inv.T @ L_inv
+        return self
+
+    def predict(self, X):
+        ''' Mean and standard deviation of the latent outputs, [point, output].'''
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        k = self._kernel(X, self.X, self.lengthscales)
+        mean = k @ self._alpha * self.y_std + self.y_mean
+        variance = np.maximum(1.0 - np.einsum("ij,jk,ik->i", k, self._K_inv, k), 0.0)
+        return mean, np.sqrt(variance)[:, None] * self.y_std
+
+    def variance(self, X, design):
+        ''' Standardized predictive variance at X if the design points were
+        the training inputs (depends on inputs only, not on outputs).'''
+        K = self._kernel(design, design, self.lengthscales) + np.eye(len(design)) * self.jitter
+        K[np.diag_indices(len(self.X))] += self.noise
+        k = self._kernel(X, design, self.lengthscales)
+        return np.maximum(1.0 - np.einsum("ij,ij->i", k, np.linalg.solve(K, k.T).T), 0.0)
+
+
+class Emulator:
+    ''' Surrogate of the simulator's weekly output over the parameter box.
+    simulate maps a batch of parameter vectors [point, parameter] to
+    weekly output [point, replicate, week], e.g. Calibration.simulate.
+    The GP is trained on the replicate means with the replicate variance
+    as noise, on log1p counts by default (weekly censuses run from
+    extinction to tens of thousands over the box), and answers predict()
+    in microseconds. refine() adds design points where the surrogate is
+    least certain, and needs_simulation() flags parameters whose
+    prediction is not to be trusted (outside the box or too uncertain).'''
+
+    def __init__(self, simulate, bounds=BOUNDS, parameters=PARAMETERS, log=True, seed=0):
+        self.simulate = simulate
+        self.log = log
+        self.bounds = np.array(bounds, dtype=float)
+        self.parameters = parameters
+        self.rng = np.random.default_rng(seed)
+        self.gp = GaussianProcess()
+        self.X = np.empty((0, len(self.bounds)))     # unit box
+        self.Y = None                                # replicate means [point, week], log1p if log
+        self.noise = np.empty(0)
+        self.history = []
+
+    def to_unit(self, x):
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        return (np.atleast_2d(np.asarray(x, dtype=float)) - low) / (high - low)
+
+    def from_unit(self, unit):
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        return low + np.asarray(unit) * (high - low)
+
+    def add(self, unit):
+        ''' Simulate design points (unit box) and refit the surrogate.'''
+        weekly = np.asarray(self.simulate(self.from_unit(unit)), dtype=float)
+        if self.log:
+            weekly = np.log1p(weekly)
+        means = weekly.mean(axis=1)
+        replicates = weekly.shape[1]
+        noise = weekly.var(axis=1, ddof=1).mean(axis=1) / replicates if replicates > 1 else np.zeros(len(unit))
+        self.X = np.vstack([self.X, unit])
+        self.Y = means if self.Y is None else np.vstack([self.Y, means])
+        self.noise = np.concatenate([self.noise, noise])
+        self.gp.fit(self.X, self.Y, self.noise)
+        self.history.append({"points": len(self.X), "log_likelihood": float(self.gp.log_likelihood)})
+        return self
+
+    def initial_design(self, n=40):
+        return self.add(latin_hypercube(n, len(self.bounds), self.rng))
+
+    def refine(self, rounds=5, batch_size=8, candidates=2000, tolerance=None):
+        ''' Adaptive design: each round picks batch_size points of largest
+        predictive variance among random candidates, one at a time as if
+        the points already picked were simulated, then simulates them.
+        Stops early once the worst candidate is within tolerance
+        (relative standard deviation, see needs_simulation).'''
+        for _ in range(rounds):
+            pool = self.rng.random((candidates, len(self.bounds)))
+            if tolerance is not None and not self.needs_simulation(self.from_unit(pool), tolerance).any():
+                break
+            design = self.X
+            picked = []
+            for _ in range(batch_size):
+                best = int(np.argmax(self.gp.variance(pool, design)))
+                picked.append(pool[best])
+                design = np.vstack([design, pool[best]])
+                pool = np.delete(pool, best, axis=0)
+            self.add(np.array(picked))
+        return self
+
+    def predict(self, x):
+        ''' Predicted weekly output and its standard deviation for
+        parameter vectors x [point, parameter]. With log, the median
+        expm1 of the log-scale mean and the delta-method std.'''
+        mean, std = self.gp.predict(self.to_unit(x))
+        if self.log:
+            mean = np.expm1(mean)
+            std = std * (1 + mean)
+        return mean, std
+
+    def needs_simulation(self, x, tolerance=0.05):
+        ''' True where the surrogate should not be trusted: outside the
+        training box, or a weekly standard deviation above tolerance times
+        the predicted value (floored at 1 fly).'''
+        unit = self.to_unit(x)
+        mean, std = self.gp.predict(unit)
+        outside = ((unit < 0) | (unit > 1)).any(axis=1)
+        return outside | (std / np.maximum(np.abs(mean), 1.0) > tolerance).any(axis=1)
+
+    def score(self, x, calibration):
+        ''' Calibration.score on the predicted weekly output instead of
+        simulations, for screening candidates before simulating them.'''
+        mean, _ = self.predict(x)
+        return calibration.loss(mean[:, None, :], calibration.data,
+                                weights=calibration.weights, **calibration.loss_args)
+
+    def save(self, path):
+        np.savez(path, X=self.X, Y=self.Y, noise=self.noise, bounds=self.bounds,
+                 lengthscales=self.gp.lengthscales, log=self.log)
+
+    def load(self, path):
+        ''' Restore the training set of save() and refit (no simulation).'''
+        with np.load(path) as data:
+            self.X, self.Y, self.noise = data["X"], data["Y"], data["noise"]
+            self.bounds, self.log = data["bounds"], bool(data["log"])
+            self.gp = GaussianProcess(data["lengthscales"])
+        self.gp.fit(self.X, self.Y, self.noise, sweeps=1)
+        return self
+
+if __name__ == "__main__":
+    import time
+    from calibration import Calibration
+    with Calibration(replicates=4, engine="cohort") as calibration:
+        emulator = Emulator(calibration.simulate, seed=1)
+        start = time.time()
+        emulator.initial_design(48).refine(rounds=4, batch_size=8)
+        print(f"trained on {len(emulator.X)} points in {time.time() - start:.0f} s, "
+              f"length scales {np.round(emulator.gp.lengthscales, 2)}")
+        test = emulator.from_unit(latin_hypercube(16, len(BOUNDS), np.random.default_rng(7)))
+        truth = calibration.simulate(test).mean(axis=1)
+    mean, std = emulator.predict(test)
+    start = time.perf_counter()
+    for x in test:
+        emulator.predict(x)
+    per_call = (time.perf_counter() - start) / len(test)
+    error = np.abs(np.log1p(mean) - np.log1p(truth))
+    print(f"median |log error| {np.median(error):.3f}, "
+          f"truth within 2 sd {np.mean(np.abs(mean - truth) <= 2 * std + 1):.0%}, "
+          f"{per_call * 1e6:.0f} us per prediction, "
+          f"{emulator.needs_simulation(test).sum()} of {len(test)} flagged for simulation")
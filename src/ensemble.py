@@ -0,0 +1,91 @@
+import multiprocessing
+import numpy as np
+from model import Experiment
+
+def weekly_food_schedule(days, shelf_life=14):
+    """Food cups every 7 days for the whole run, as in minimize_fit.py."""
+    food_init_dates = list(range(0, days, 7))
+    return {"food_init_dates": food_init_dates,
+            "food_shelf_life": [shelf_life] * len(food_init_dates)}
+
+def run_experiment(task):
+    """Run one replicate. task = (set_index, replicate, params, days, seed_seq)."""
+    set_index, replicate, params, days, seed_seq = task
+    kwargs = dict(params, seed=seed_seq)
+    if "food_init_dates" not in kwargs:
+        kwargs.update(weekly_food_schedule(days))
+    experiment = Experiment(**kwargs)
+    for _ in range(days):
+        experiment.update_day()
+    return {"set": set_index,
+            "replicate": replicate,
+            "params": params,
+            "spawn_key": seed_seq.spawn_key,
+            "daily_data": experiment.daily_data,
+            "fit_data": experiment.mortality_census_fit_data(),
+            "metrics": experiment.instruments.records if experiment.instruments else None}
+
+def ensemble_tasks(param_sets, replicates=1, days=154, seed=None, common_random_numbers=False):
+    ''' Expand parameter sets x replicates into worker tasks.
+    Every task gets its own SeedSequence child, so a replicate's stream
+    depends only on (seed, task position), never on the worker running it.
+    With common_random_numbers, replicate r of every set shares one child,
+    so differences between sets are not drowned in seed noise.'''
+    if isinstance(replicates, int):
+        replicates = [replicates] * len(param_sets)
+    if len(replicates) != len(param_sets):
+        raise ValueError("replicates must be an int or have one count per parameter set.")
+    root = np.random.SeedSequence(seed)
+    if common_random_numbers:
+        shared = root.spawn(max(replicates, default=0))
+    else:
+        children = iter(root.spawn(sum(replicates)))
+    tasks = []
+    for set_index, (params, count) in enumerate(zip(param_sets, replicates)):
+        for replicate in range(count):
+            seed_seq = shared[replicate] if common_random_numbers else next(children)
+            tasks.append((set_index, replicate, params, days, seed_seq))
+    return tasks
+
+def run_ensemble(param_sets, replicates=1, days=154, seed=None, processes=None, chunksize=1,
+                 common_random_numbers=False, pool=None):
+    ''' Run every parameter set `replicates` times across a process pool.
+    param_sets: list of dicts of Experiment keyword arguments; a weekly food
+    schedule is added when none is given. Results are yielded as they finish
+    (not in submission order), each a dict with the set index, replicate
+    number, seed spawn key, daily_data and mortality_census_fit_data(),
+    plus the per-day instrumentation records as "metrics" for sets run
+    with instrument=True (see instrument.aggregate).
+    An existing multiprocessing pool can be reused across calls.'''
+    tasks = ensemble_tasks(param_sets, replicates, days, seed, common_random_numbers)
+    if pool is not None:
+        yield from pool.imap_unordered(run_experiment, tasks, chunksize)
+        return
+    if processes == 1:
+        for task in tasks:
+            yield run_experiment(task)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(run_experiment, tasks, chunksize):
+            yield result
+
+def collect_ensemble(param_sets, replicates=1, days=154, seed=None, processes=None, **kwargs):
+    """Run an ensemble and return fit data as arrays, one [replicate, week] array per set."""
+    if isinstance(replicates, int):
+        replicates = [replicates] * len(param_sets)
+    fits = [[None] * count for count in replicates]
+    for result in run_ensemble(param_sets, replicates, days, seed, processes, **kwargs):
+        fits[result["set"]][result["replicate"]] = result["fit_data"]
+    return [np.array(rows) for rows in fits]
+
+if __name__ == "__main__":
+    import time
+    import census_data
+    # one parameter set per DSPR cage, initial sizes from the first census week
+    census = census_data.load()
+    param_sets = [{"pop_size": int(size), "engine": "arrays"} for size in census.census[:, 0]]
+    start = time.time()
+    fits = collect_ensemble(param_sets, replicates=50, seed=2025)
+    print(f"{len(param_sets)} cages x 50 replicates in {time.time() - start:.1f} s")
+    for cage, runs in zip(census.cages, fits):
+        print(cage, runs.mean(axis=0).round(0))
@@ -0,0 +1,92 @@
+import heapq
+
+# kinds of scheduled cup events
+ARRIVAL, EXPIRY = 0, 1
+
+class FoodCup:
+    def __init__(self, creation_day, food=30.0, fly_daily_rate = 0.00001, cup_id = 0):
+        self.creation_day = creation_day  # Day this cup was added
+        self.cup_id = cup_id              # Index of the cup within its experiment
+        self.food = food                  # Initial food (grams)
+        self.spent = False
+        self.fly_daily_rate = fly_daily_rate          # standard day consumption per fly
+        self.flies_ID = []
+        self.held = 0                     # flies ever laid on the cup
+
+    def deplete(self, occupants):
+        """One day of feeding for the living pre-adults on the cup."""
+        self.food -= self.fly_daily_rate * occupants
+        self.food = max(0, self.food)
+        if self.food == 0:
+            self.spent = True
+
+    def hold(self, new_fly_ID):
+        self.flies_ID.append(new_fly_ID)
+        self.held += 1
+
+    def hold_many(self, new_fly_IDs):
+        self.flies_ID.extend(new_fly_IDs)
+        self.held += len(new_fly_IDs)
+
+    def hold_count(self, count):
+        """Account for flies without IDs (cohort engine)."""
+        self.held += int(count)
+
+
+class CupScheduler:
+    ''' Food cups driven by a priority queue of arrival and expiry events.
+    Every day each active cup is depleted once by the living pre-adults
+    it holds (occupancy, see advance), cups whose expiry event is due or whose food ran out are retired, and
+    the cups due to arrive are added. The daily work is one pass over the
+    active cups plus the events due, however long the feeding schedule.'''
+
+    def __init__(self, fly_daily_rate=0.00001, food=30.0, first_id=0, id_step=1):
+        self.fly_daily_rate = fly_daily_rate
+        self.food = food
+        self.events = []        # heap of (day, kind, order, value)
+        self._order = 0         # keeps events of one day in scheduling order
+        self.active = []        # cups in arrival order
+        self.spent = []
+        self._cup_count = 0
+        # cup ids first_id, first_id + id_step, ... so several schedulers
+        # (one per cage) can share one population without clashes
+        self.first_id = first_id
+        self.id_step = id_step
+
+    def _push(self, day, kind, value):
+        heapq.heappush(self.events, (day, kind, self._order, value))
+        self._order += 1
+
+    def schedule(self, start, shelf_life):
+        """A cup arriving on day start and expiring shelf_life days later."""
+        self._push(start, ARRIVAL, shelf_life)
+
+    def advance(self, day, occupancy=None):
+        ''' Run one day of cup events. occupancy maps cup_id to the living
+        pre-adults on the cup today (cups left out are empty), e.g. from
+        FlyArrays.cup_occupancy(). Returns the cups retired today.'''
+        occupancy = occupancy or {}
+        retiring = set()
+        for cup in self.active:
+            cup.deplete(occupancy.get(cup.cup_id, 0))
+            if cup.spent:
+                retiring.add(cup.cup_id)
+        arrivals = []
+        while self.events and self.events[0][0] <= day:
+            _, kind, _, value = heapq.heappop(self.events)
+            if kind == EXPIRY:
+                retiring.add(value)
+            else:
+                arrivals.append(value)
+        retired = [cup for cup in self.active if cup.cup_id in retiring]
+        if retired:
+            self.active = [cup for cup in self.active if cup.cup_id not in retiring]
+            self.spent.extend(retired)
+        for shelf_life in arrivals:
+            cup = FoodCup(creation_day=day, food=self.food,
+                          fly_daily_rate=self.fly_daily_rate,
+                          cup_id=self.first_id + self.id_step * self._cup_count)
+            self._cup_count += 1
+            self.active.append(cup)
+            self._push(day + shelf_life, EXPIRY, cup.cup_id)
+        return retired
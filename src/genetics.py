@@ -0,0 +1,136 @@
+import csv
+import numpy as np
+from population import STAGES, ADULT
+
+class GeneticsTracker:
+    ''' Streaming population-genetic summaries, Experiment(genetics=...).
+    Keeps a running table of living flies by stage x sex x transgenic
+    status x receptivity-vigor bin, updated as flies are added, change
+    stage and are removed (like PopulationCounts), so the daily summary
+    never rescans the population. The cohort engine already counts flies
+    by vigor bin and is read directly. At the end of each day one record
+    is kept with the adult allele-frequency histogram, transgene
+    frequency, heterozygosities and Ne estimates; pool-seq style samples
+    are drawn on pool_seq_days.'''
+
+    def __init__(self, bins=20, pool_seq_days=(), pool_size=100, depth=None, generation_days=14):
+        self.bins = bins
+        self.pool_seq_days = set(pool_seq_days)
+        self.pool_size = pool_size
+        self.depth = depth                      # reads per sample, None for the exact pool
+        self.generation_days = generation_days  # egg to egg, for temporal Ne
+        self.table = np.zeros((len(STAGES), 2, 2, bins), dtype=np.int64)
+        self._source = None                     # FlyCohorts to read the table from
+        self.records = []
+        self.histograms = []                    # adult allele counts per bin, one row per day
+        self.samples = []                       # pool-seq samples
+        self._inverse_ne = 0.0
+        self._ne_days = 0
+
+    def attach(self, experiment):
+        ''' Hook into an experiment before its founders are added.'''
+        if experiment.engine == "arrays":
+            experiment.population.genetics = self
+        elif experiment.engine == "cohort":
+            self._source = experiment.population
+            self.bins = experiment.population.bins
+            self.table = np.zeros((len(STAGES), 2, 2, self.bins), dtype=np.int64)
+
+    def vigor_bin(self, trait):
+        return np.minimum((np.asarray(trait) * self.bins).astype(np.int64), self.bins - 1)
+
+    def add(self, stage, sex, lethal, trait, n=1):
+        self.table[stage, sex, lethal, self.vigor_bin(trait)] += n
+
+    def add_many(self, stage, sex, lethal, trait, sign=1):
+        """Count (or with sign=-1 discount) a cohort given as arrays."""
+        cells = ((np.asarray(stage, dtype=np.int64) * 2 + sex) * 2 + lethal) * self.bins + self.vigor_bin(trait)
+        self.table += sign * np.bincount(cells, minlength=self.table.size).reshape(self.table.shape)
+
+    @property
+    def adults(self):
+        ''' Adult counts [sex, transgenic-lethal, vigor bin].'''
+        if self._source is not None:
+            self.table = self._source.vigor_table()
+        return self.table[ADULT]
+
+    def end_day(self, experiment):
+        adults = self.adults
+        histogram = adults.sum(axis=(0, 1))
+        n = int(histogram.sum())
+        males, females = adults.sum(axis=(1, 2)).tolist()
+        transgene = adults[:, 1].sum() / n if n else np.nan
+        frequencies = histogram / n if n else np.full(self.bins, np.nan)
+        midpoints = (np.arange(self.bins) + 0.5) / self.bins
+        # Ne from the adult sex ratio, and its harmonic mean over the run
+        ne = 4 * males * females / (males + females) if males and females else 0.0
+        if ne > 0:
+            self._inverse_ne += 1 / ne
+            self._ne_days += 1
+        self.histograms.append(histogram)
+        self.records.append({"day": experiment.day,
+                             "adults": n,
+                             "transgene_freq": float(transgene),
+                             "mean_vigor": float(frequencies @ midpoints),
+                             "het_vigor": float(1 - (frequencies ** 2).sum()),
+                             "het_transgene": float(2 * transgene * (1 - transgene)),
+                             "ne_sex_ratio": ne,
+                             "ne_harmonic": self._ne_days / self._inverse_ne if self._inverse_ne else 0.0})
+        if experiment.day in self.pool_seq_days:
+            self.samples.append(self.pool_seq(experiment.rng.sampling, day=experiment.day))
+
+    def pool_seq(self, rng=None, pool_size=None, depth=None, day=None):
+        ''' Pool-seq style sample of the current adults: pool_size flies
+        drawn without replacement, then `depth` reads from the pool when
+        depth is given. Returns the day, pool size, depth, sampled vigor
+        bin frequencies and transgene frequency.'''
+        rng = np.random.default_rng() if rng is None else rng
+        pool_size = self.pool_size if pool_size is None else pool_size
+        depth = self.depth if depth is None else depth
+        adults = self.adults.reshape(-1)
+        size = min(pool_size, int(adults.sum()))
+        if size == 0:
+            return {"day": day, "pool_size": 0, "depth": depth,
+                    "frequencies": np.full(self.bins, np.nan), "transgene_freq": np.nan}
+        pool = rng.multivariate_hypergeometric(adults, size).reshape(2, 2, self.bins)
+        frequencies = pool.sum(axis=(0, 1)) / size
+        transgene = pool[:, 1].sum() / size
+        if depth:
+            frequencies = rng.multinomial(depth, frequencies) / depth
+            transgene = rng.binomial(depth, transgene) / depth
+        return {"day": day, "pool_size": size, "depth": depth,
+                "frequencies": frequencies, "transgene_freq": float(transgene)}
+
+    def allele_frequencies(self):
+        ''' Adult vigor bin frequencies, array [day, bin].'''
+        histograms = np.array(self.histograms, dtype=float).reshape(-1, self.bins)
+        totals = histograms.sum(axis=1, keepdims=True)
+        return np.divide(histograms, totals, out=np.full_like(histograms, np.nan), where=totals > 0)
+
+    def temporal_ne(self, first=0, last=-1):
+        ''' Ne from the allele frequency change between two pool-seq samples
+        (Nei & Tajima's Fc, corrected for sampling as in Waples 1989).'''
+        a, b = self.samples[first], self.samples[last]
+        generations = (b["day"] - a["day"]) / self.generation_days
+        x, y = a["frequencies"], b["frequencies"]
+        present = ((x + y) / 2 - x * y) > 0
+        x, y = x[present], y[present]
+        fc = np.mean((x - y) ** 2 / ((x + y) / 2 - x * y))
+        drift = fc - 1 / (2 * a["pool_size"]) - 1 / (2 * b["pool_size"])
+        return generations / (2 * drift) if drift > 0 else np.inf
+
+    def to_csv(self, path):
+        ''' Daily summaries, including the Ne estimates.'''
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(self.records[0]) if self.records else ["day"])
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def pool_seq_to_csv(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["day", "pool_size", "depth", "transgene_freq"]
+                            + [f"bin_{i}" for i in range(self.bins)])
+            for sample in self.samples:
+                writer.writerow([sample["day"], sample["pool_size"], sample["depth"],
+                                 sample["transgene_freq"]] + list(sample["frequencies"]))
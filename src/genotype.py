@@ -0,0 +1,131 @@
+import numpy as np
+
+# inheritance modes of a locus
+RANDOM = "random"          # drawn fresh for every offspring (sex)
+PATERNAL = "paternal"      # copied from the father (transgenic-lethal)
+MATERNAL = "maternal"      # copied from the mother
+MENDELIAN = "mendelian"    # one parental allele chosen at random
+
+class GenotypeLayout:
+    ''' Bit layout of the packed genotype shared by a whole population.
+    Discrete loci live side by side in one unsigned integer per fly
+    ("loci" column); the continuous receptivity-vigor allele is a separate
+    float32 "trait" column. Adding a locus only claims free bits, so it
+    costs no memory per fly until the 32 bits of the word are used up.'''
+
+    WORD = np.uint32
+    WORD_BITS = 32
+
+    def __init__(self, trait="receptivity-vigor"):
+        self.trait = trait
+        self.loci = {}           # name -> (shift, bits, inheritance)
+        self._used_bits = 0
+
+    def add_locus(self, name, bits=1, inheritance=MENDELIAN):
+        if name in self.loci:
+            raise ValueError(f"Locus {name} already in layout.")
+        if inheritance not in (RANDOM, PATERNAL, MATERNAL, MENDELIAN):
+            raise ValueError(f"Unknown inheritance mode {inheritance}.")
+        if self._used_bits + bits > self.WORD_BITS:
+            raise ValueError("Genotype word is full.")
+        self.loci[name] = (self._used_bits, bits, inheritance)
+        self._used_bits += bits
+        return self
+
+    def _mask(self, name):
+        shift, bits, _ = self.loci[name]
+        return ((1 << bits) - 1) << shift
+
+    def get(self, loci, name):
+        """Values of one locus from packed words."""
+        shift, bits, _ = self.loci[name]
+        return ((np.asarray(loci, dtype=self.WORD) >> shift) & ((1 << bits) - 1)).astype(np.int8 if bits <= 7 else np.int32)
+
+    def set(self, loci, name, values):
+        """Packed words with one locus replaced."""
+        shift, _, _ = self.loci[name]
+        loci = np.asarray(loci, dtype=self.WORD) & self.WORD(~self._mask(name) & 0xFFFFFFFF)
+        return loci | (np.asarray(values, dtype=self.WORD) << self.WORD(shift))
+
+    def pack(self, genotype, size=None):
+        ''' Pack a genotype dict (scalars or arrays per locus, as in
+        Drosophila.genotype) into words. Loci missing from the dict are 0.'''
+        if size is None:
+            size = np.broadcast_shapes(*(np.shape(value) for value in genotype.values()))
+        loci = np.zeros(size, dtype=self.WORD)
+        for name in self.loci:
+            if name in genotype:
+                loci = self.set(loci, name, genotype[name])
+        return loci
+
+    def unpack(self, loci, trait):
+        """Genotype dict of one fly, the Drosophila.genotype format."""
+        genotype = {name: int(self.get(loci, name)) for name in self.loci}
+        genotype[self.trait] = float(trait)
+        return genotype
+
+    def wildtype(self, size, rng=None):
+        ''' Wildtype genotypes: RANDOM loci drawn, every other locus 0,
+        trait uniform on [0, 1) (Drosophila._wildtype_genotype).'''
+        rng = np.random.default_rng() if rng is None else rng
+        loci = np.zeros(size, dtype=self.WORD)
+        for name, (_, bits, inheritance) in self.loci.items():
+            if inheritance == RANDOM:
+                loci = self.set(loci, name, rng.integers(1 << bits, size=size))
+        return loci, rng.random(size, dtype=np.float32)
+
+    def inherit(self, mother_loci, father_loci, mother_trait, father_trait, mutation_rate=0.0, rng=None):
+        ''' Offspring genotypes, one per (mother, father) pair.
+        Loci follow their inheritance mode; the trait is one parental
+        allele chosen at random (Drosophila._inherit_allele) and flips to
+        1 - allele with probability mutation_rate.'''
+        rng = np.random.default_rng() if rng is None else rng
+        size = len(mother_loci)
+        mother_loci = np.asarray(mother_loci, dtype=self.WORD)
+        father_loci = np.asarray(father_loci, dtype=self.WORD)
+        # bits taken from the father, one coin per mendelian locus
+        from_father = np.zeros(size, dtype=self.WORD)
+        random_bits = np.zeros(size, dtype=self.WORD)
+        for name, (shift, bits, inheritance) in self.loci.items():
+            mask = self.WORD(self._mask(name))
+            if inheritance == PATERNAL:
+                from_father |= mask
+            elif inheritance == MENDELIAN:
+                from_father |= np.where(rng.random(size) < 0.5, mask, self.WORD(0))
+            elif inheritance == RANDOM:
+                random_bits |= rng.integers(1 << bits, size=size).astype(self.WORD) << self.WORD(shift)
+        random_mask = self.WORD(sum(self._mask(name) for name, (_, _, mode) in self.loci.items()
+                                    if mode == RANDOM))
+        keep = ~random_mask
+        loci = ((father_loci & from_father) | (mother_loci & ~from_father)) & keep
+        loci |= random_bits
+        trait = np.where(rng.random(size) < 0.5, father_trait, mother_trait).astype(np.float32)
+        if mutation_rate > 0:
+            trait = mutate_trait(trait, mutation_rate, rng=rng)
+        return loci, trait
+
+    def mutate(self, loci, name, rate, rng=None):
+        """Replace the allele at one locus with a random one at the given rate."""
+        rng = np.random.default_rng() if rng is None else rng
+        _, bits, _ = self.loci[name]
+        hit = rng.random(len(loci)) < rate
+        mutated = self.set(loci[hit], name, rng.integers(1 << bits, size=np.count_nonzero(hit)))
+        loci = np.array(loci, dtype=self.WORD)
+        loci[hit] = mutated
+        return loci
+
+def mutate_trait(trait, rate, rng=None):
+    """Flip trait alleles to 1 - allele at the given rate."""
+    rng = np.random.default_rng() if rng is None else rng
+    trait = np.array(trait, dtype=np.float32)
+    hit = rng.random(len(trait)) < rate
+    trait[hit] = 1 - trait[hit]
+    return trait
+
+def default_layout():
+    """Loci of the current model: sex and the transgenic-lethal construct."""
+    return (GenotypeLayout()
+            .add_locus("sex", inheritance=RANDOM)                    # 0 male, 1 female
+            .add_locus("transgenic-lethal", inheritance=PATERNAL))   # 0 wildtype, 1 transgenic
+
+GENOTYPE = default_layout()
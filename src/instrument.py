@@ -0,0 +1,104 @@
+import csv
+import json
+import time
+import numpy as np
+
+# phases of Experiment.update_day, in running order
+PHASES = ("aging", "mortality", "cups", "collect", "release", "mating", "oviposition", "logging")
+# running Experiment totals reported as per-day differences
+COUNTERS = ("eggs", "matings", "culls", "retired_cups")
+
+def _counters(experiment):
+    return {"eggs": experiment.eggs_laid,
+            "matings": experiment.mating_count,
+            "culls": experiment.cull_count,
+            "retired_cups": len(experiment.spent_food_cups)}
+
+class Instrumentation:
+    ''' Opt-in per-day metrics of an Experiment, Experiment(instrument=...).
+    Each day gives one record with the seconds spent in every update_day
+    phase (<phase>_s), the day's eggs laid, matings, culls and cup
+    retirements, and the adult census. Observers are called at the end
+    of each day as observer(experiment, record). Observers are usually
+    lambdas or bound methods, so they are left out of pickles
+    (Experiment.snapshot, checkpoints): a restored run must add its
+    observers again, Experiment.fork carries them over.'''
+
+    def __init__(self, observers=()):
+        self.observers = list(observers)
+        self.records = []
+        self._clock = time.perf_counter
+        self._start = None
+        self._counters = None
+        self._record = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["observers"] = []
+        return state
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def start_day(self, experiment):
+        self._counters = _counters(experiment)
+        self._record = {"day": experiment.day}
+        self._start = self._clock()
+
+    def lap(self, phase):
+        now = self._clock()
+        self._record[phase + "_s"] = now - self._start
+        self._start = now
+
+    def end_day(self, experiment):
+        record = self._record
+        for name, value in _counters(experiment).items():
+            record[name] = value - self._counters[name]
+        _, record["adults"], record["males"], record["females"], record["adult_mortality"] = experiment.daily_data[-1]
+        self.records.append(record)
+        for observer in self.observers:
+            observer(experiment, record)
+
+    def totals(self):
+        ''' Sums over the run of every metric but the day and census.'''
+        skip = ("day", "adults", "males", "females")
+        return {name: sum(record[name] for record in self.records)
+                for name in (self.records[0] if self.records else ()) if name not in skip}
+
+    def to_csv(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(self.records[0]) if self.records else ["day"])
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def to_json(self, path):
+        with open(path, "w") as file:
+            json.dump({"records": self.records, "totals": self.totals()}, file, indent=2)
+
+
+def no_lap(phase):
+    """Stand-in for Instrumentation.lap when a run is not instrumented."""
+
+def aggregate(runs):
+    ''' Per-day mean and standard deviation of every metric across runs
+    (Instrumentation objects or their record lists, e.g. the "metrics" of
+    ensemble results), over the days all runs reached.
+    Returns {metric: {"mean": array, "std": array}} plus "day".'''
+    runs = [run.records if isinstance(run, Instrumentation) else run for run in runs]
+    days = min(len(records) for records in runs)
+    names = [name for name in runs[0][0] if name != "day"]
+    summary = {"day": np.array([record["day"] for record in runs[0][:days]])}
+    for name in names:
+        values = np.array([[record[name] for record in records[:days]] for records in runs], dtype=float)
+        summary[name] = {"mean": values.mean(axis=0), "std": values.std(axis=0)}
+    return summary
+
+def aggregate_to_csv(runs, path):
+    ''' aggregate() written as one row per day, <metric>_mean and <metric>_std columns.'''
+    summary = aggregate(runs)
+    names = [name for name in summary if name != "day"]
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["day"] + [f"{name}_{stat}" for name in names for stat in ("mean", "std")])
+        for i, day in enumerate(summary["day"].tolist()):
+            writer.writerow([day] + [summary[name][stat][i] for name in names for stat in ("mean", "std")])
@@ -0,0 +1,248 @@
+import numpy as np
+from population import FlyArrays, ADULT, draw_clutches
+from genotype import GENOTYPE
+from food import CupScheduler
+from rng import RandomStreams
+from model import Drosophila, mortality_census_fit_data
+
+# per-cage settings, with the Experiment defaults
+CAGE_DEFAULTS = {"pop_size": 30,
+                 "p_daily": 0.1,
+                 "clutch_size": 5,
+                 "consumption_rate": 0.00001,
+                 "mating_threshold": 1.0,
+                 "release_dates": None,
+                 "release_sizes": None,
+                 "food_init_dates": None,
+                 "food_shelf_life": None,
+                 "name": None}
+
+class Metapopulation:
+    ''' Many cages advanced in lockstep in one FlyArrays population, the
+    "cage" column telling them apart. Each cage is a dict of Experiment
+    keyword arguments (pop_size, p_daily, clutch_size, consumption_rate,
+    mating_threshold, release and food schedules, plus a name), so cages
+    can differ in parameters and schedules. Flies only meet mates and lay
+    on cups of their own cage. Adults can move between cages through a
+    daily migration matrix (migration[i][j]: probability that an adult of
+    cage i moves to cage j on a given day) or transfer events
+    (day, source, target, count) moving count random adults. Every daily
+    step is one vectorized operation over all cages; daily_data keeps the
+    Experiment log rows per cage.'''
+
+    def __init__(self, cages, migration=None, transfers=None, multiple_mating=False,
+                 last_male_precedence=True, seed=None):
+        self.day = 0
+        self.rng = RandomStreams(seed)
+        self.n_cages = len(cages)
+        settings = []
+        for index, cage in enumerate(cages):
+            unknown = set(cage) - set(CAGE_DEFAULTS)
+            if unknown:
+                raise ValueError(f"Unknown cage settings {sorted(unknown)}.")
+            settings.append(dict(CAGE_DEFAULTS, **cage))
+        self.names = [cage["name"] or str(index) for index, cage in enumerate(settings)]
+        self.p_daily = np.array([cage["p_daily"] for cage in settings], dtype=float)
+        self.clutch_size = np.array([cage["clutch_size"] for cage in settings], dtype=np.int64)
+        self.mating_threshold = np.array([cage["mating_threshold"] for cage in settings], dtype=float)
+        self.multiple_mating = multiple_mating
+        self.last_male_precedence = last_male_precedence
+        self.mating_count = 0
+        self.eggs_laid = 0
+        self.population = FlyArrays()
+
+        # one cup scheduler per cage, cup ids interleaved so they never clash
+        self.cup_schedulers = []
+        self.release_schedules = []
+        for index, cage in enumerate(settings):
+            scheduler = CupScheduler(fly_daily_rate=cage["consumption_rate"],
+                                     first_id=index, id_step=self.n_cages)
+            if cage["food_init_dates"] is not None:
+                if cage["food_shelf_life"] is None:
+                    raise ValueError("food_init_dates, and food_shelf_life must all be provided.")
+                if len(cage["food_init_dates"]) != len(cage["food_shelf_life"]):
+                    raise ValueError("Food scheduling vectors must have the same length.")
+                for start, shelf_life in zip(cage["food_init_dates"], cage["food_shelf_life"]):
+                    scheduler.schedule(start, shelf_life)
+            self.cup_schedulers.append(scheduler)
+            release = {}
+            if cage["release_dates"] is not None:
+                if cage["release_sizes"] is None:
+                    raise ValueError("Both release_dates and release_sizes must be provided if one is given.")
+                if len(cage["release_dates"]) != len(cage["release_sizes"]):
+                    raise ValueError("release_dates and release_sizes must be of the same length.")
+                release = dict(zip(cage["release_dates"], cage["release_sizes"]))
+            self.release_schedules.append(release)
+
+        self.migration = None
+        if migration is not None:
+            migration = np.array(migration, dtype=float)
+            if migration.shape != (self.n_cages, self.n_cages):
+                raise ValueError("migration must be a cages x cages matrix.")
+            np.fill_diagonal(migration, 0.0)
+            if (migration.sum(axis=1) > 1).any():
+                raise ValueError("Migration probabilities out of a cage must sum to at most 1.")
+            # cumulative rows, an adult moves to the first cage its draw falls under
+            self.migration = np.cumsum(migration, axis=1)
+        self.transfers = {}
+        for day, source, target, count in transfers or ():
+            self.transfers.setdefault(day, []).append((source, target, count))
+
+        self.daily_data = [[] for _ in range(self.n_cages)]
+        for index, cage in enumerate(settings):
+            loci, trait = GENOTYPE.wildtype(cage["pop_size"], rng=self.rng.genetics)
+            self.population.add(Drosophila.reserve_ids(cage["pop_size"]),
+                                bday=self.day,
+                                age=12,     # always initialize with adults
+                                loci=loci,
+                                trait=trait,
+                                cage=index)
+
+    @classmethod
+    def from_census(cls, census=None, days=154, shelf_life=14, **kwargs):
+        ''' One cage per census cage, founded with its first census count
+        and fed weekly; kwargs are shared cage settings (e.g. p_daily) or
+        Metapopulation arguments (migration, transfers, seed).'''
+        import census_data
+        census = census_data.load() if census is None else census
+        food_init_dates = list(range(0, days, 7))
+        shared = {key: kwargs.pop(key) for key in list(kwargs) if key in CAGE_DEFAULTS}
+        cages = [dict({"food_init_dates": food_init_dates,
+                       "food_shelf_life": [shelf_life] * len(food_init_dates)},
+                      **shared, pop_size=int(size), name=name)
+                 for name, size in zip(census.cages, census.census[:, 0])]
+        return cls(cages, **kwargs)
+
+    def update_day(self):
+        pop = self.population
+        pop.update(rng=self.rng.mortality)
+        pop.mortality_round(self.p_daily[pop["cage"]], rng=self.rng.mortality)
+        occupancy = pop.cup_occupancy()
+        for scheduler in self.cup_schedulers:
+            for spent_cup in scheduler.advance(self.day, occupancy):
+                pop.cull_cup(spent_cup.cup_id)
+        deaths = self.collect_dead()
+        for cage, schedule in enumerate(self.release_schedules):
+            if self.day in schedule:
+                self.add_transgenic_males(schedule[self.day], cage)
+        self.migrate()
+        self.mating_count += pop.cross(self.mating_threshold,
+                                       self.multiple_mating,
+                                       self.last_male_precedence,
+                                       rng=self.rng.mating,
+                                       group="cage")
+        self.oviposition_cycle()
+        self.log_data(deaths)
+        self.day += 1
+
+    def collect_dead(self):
+        """Drop dead flies. Returns adult deaths per cage."""
+        pop = self.population
+        dead = ~pop["alive"]
+        dead_adults = dead & (pop["age"] > 9)
+        deaths = np.bincount(pop["cage"][dead_adults], minlength=self.n_cages)
+        pop.compress(~dead)
+        return deaths
+
+    def add_transgenic_males(self, count, cage):
+        self.population.add(Drosophila.reserve_ids(count),
+                            bday=self.day,
+                            age=12,
+                            loci=GENOTYPE.pack({"sex": 0, "transgenic-lethal": 1}, size=count),
+                            trait=self.rng.genetics.random(count),
+                            cage=cage)
+
+    def migrate(self):
+        ''' Daily migration draws and today's transfer events, adults only
+        (pre-adults stay on their cup).'''
+        pop = self.population
+        if self.migration is not None:
+            adults = np.flatnonzero(pop["stage"] == ADULT)
+            draws = self.rng.migration.random(len(adults))
+            below = draws[:, None] < self.migration[pop["cage"][adults]]
+            moving = below.any(axis=1)
+            pop["cage"][adults[moving]] = below[moving].argmax(axis=1)
+        for source, target, count in self.transfers.get(self.day, ()):
+            candidates = np.flatnonzero((pop["stage"] == ADULT) & (pop["cage"] == source))
+            chosen = self.rng.migration.choice(candidates, size=min(count, len(candidates)), replace=False)
+            pop["cage"][chosen] = target
+
+    def oviposition_cycle(self):
+        ''' Every adult female lays on the active cups of her own cage.'''
+        pop = self.population
+        active = [scheduler.active for scheduler in self.cup_schedulers]
+        cups = [cup for cage_cups in active for cup in cage_cups]
+        n_cups = np.array([len(cage_cups) for cage_cups in active])
+        females = pop.adults(1)
+        females = females[n_cups[pop["cage"][females]] > 0]
+        if len(females) == 0:
+            return
+        cage = pop["cage"][females]
+        mother, loci, trait, cup_choice = draw_clutches(
+            self.clutch_size[cage],
+            pop["loci"][females],
+            pop["trait"][females],
+            pop["fecund"][females],
+            pop["sperm_loci"][females],
+            pop["sperm_trait"][females],
+            n_cups[cage],
+            rng=self.rng.oviposition,
+            genetics_rng=self.rng.genetics,
+            cups_rng=self.rng.cups)
+        if len(mother) == 0:
+            return
+        mother_rows = females[mother]
+        # index of the chosen cup in the flat list of all cages' active cups
+        flat = (np.cumsum(n_cups) - n_cups)[cage[mother]] + cup_choice
+        cup_ids = np.array([cup.cup_id for cup in cups], dtype=np.int32)
+        pop.add(Drosophila.reserve_ids(len(mother)),
+                bday=self.day,
+                age=0,
+                loci=loci,
+                trait=trait,
+                motherID=pop["id"][mother_rows],
+                fatherID=pop["mateID"][mother_rows],
+                cup=cup_ids[flat],
+                cage=cage[mother])
+        for cup, count in zip(cups, np.bincount(flat, minlength=len(cups)).tolist()):
+            cup.hold_count(count)
+        self.eggs_laid += len(mother)
+
+    def census(self):
+        ''' Adults per cage, array [cage, sex].'''
+        pop = self.population
+        adults = pop["stage"] == ADULT
+        cells = pop["cage"][adults].astype(np.int64) * 2 + pop.locus("sex")[adults]
+        return np.bincount(cells, minlength=2 * self.n_cages).reshape(self.n_cages, 2)
+
+    def log_data(self, deaths):
+        for cage, (males, females) in enumerate(self.census().tolist()):
+            self.daily_data[cage].append([self.day, males + females, males, females, int(deaths[cage])])
+
+    def mortality_census_fit_data(self):
+        ''' Experiment.mortality_census_fit_data of every cage, array [cage, week].'''
+        return np.array([mortality_census_fit_data(rows) for rows in self.daily_data])
+
+if __name__ == "__main__":
+    import time
+    from model import Experiment
+    from ensemble import weekly_food_schedule
+    days, n_cages = 154, 8
+    cage = dict(weekly_food_schedule(days), pop_size=300)
+    start = time.perf_counter()
+    for seed in range(n_cages):
+        experiment = Experiment(engine="arrays", seed=seed, **cage)
+        for _ in range(days):
+            experiment.update_day()
+    separate = time.perf_counter() - start
+    metapopulation = Metapopulation([cage] * n_cages, seed=0)
+    start = time.perf_counter()
+    for _ in range(days):
+        metapopulation.update_day()
+    together = time.perf_counter() - start
+    print(f"{n_cages} cages x {days} days: separate Experiments {separate:.2f} s, "
+          f"Metapopulation {together:.2f} s ({separate / together:.1f}x)")
+    census = Metapopulation.from_census(days=days, migration=np.full((8, 8), 0.001), seed=1)
+    for _ in range(days):
+        census.update_day()
+    print(dict(zip(census.names, census.mortality_census_fit_data()[:, -1])))
@@ -1,26 +1,18 @@
 import numpy as np
-import random
 import csv
-import matplotlib.pyplot as plt
+import os
+import pickle
+from population import FlyArrays, PopulationCounts, STAGE_CODES, draw_clutches, draw_matings
+from genotype import GENOTYPE
+from morgue import MorgueArchive, records_from_arrays, records_from_flies
+from rng import RandomStreams
+from cohort import FlyCohorts
+from food import FoodCup, CupScheduler
+from instrument import Instrumentation, no_lap
+from genetics import GeneticsTracker
 
-class FoodCup:
-    def __init__(self, creation_day, food=30.0, fly_daily_rate = 0.00001):
-        self.creation_day = creation_day  # Day this cup was added
-        self.food = food                  # Initial food (grams)
-        self.spent = False
-        self.fly_daily_rate = fly_daily_rate          # standard day consumption per fly
-        self.flies_ID = []
+ENGINES = ("objects", "arrays", "cohort")
 
-    def deplete(self):
-        self.food -= self.fly_daily_rate * len(self.flies_ID)
-        self.food = max(0, self.food)
-        if self.food == 0:
-            self.spent = True
-
-    def hold(self, new_fly_ID):
-        self.flies_ID.append(new_fly_ID)
-
-    
 class Drosophila:
     # ID zero is only for founding population
     _next_id = 1
@@ -32,12 +24,14 @@ class Drosophila:
                  motherID = 0,
                  fatherID = 0,
                  spermatheque=None, 
-                 mating_threshold = 1.0):
+                 mating_threshold = 1.0,
+                 rng = None):
         # class variable that increments with each fly
 
         ''' Set initial values'''
         self.alive = True  # Track viability
-        self.genotype = genotype or self._wildtype_genotype()
+        self.cause = None  # Cause of death, see population.CAUSES
+        self.genotype = genotype or self._wildtype_genotype(rng)
         self.mating_threshold = mating_threshold
         self.bday = bday
         self.dday = None
@@ -48,6 +42,7 @@ class Drosophila:
         Drosophila._next_id += 1
         self.fatherID = fatherID
         self.motherID = motherID
+        self.cup = None     # ID of the food cup the fly was laid on
         
         '''Define stages and age'''
         if self.age == 0:    # Tracks time in current stage
@@ -64,39 +59,53 @@ class Drosophila:
         #female spescific attributes
         if self.genotype["sex"] == 1:   # sex locus = 1: female
             self.spermatheque = []
+            self.mates = []             # IDs of males in spermatheque order
             self.fecund = False
         else:                           # sex locus = 0: male
             self.spermatheque = None
+            self.mates = None
             self.fecund = None
 
 
-    def _wildtype_genotype(self):
-        # will be good to adjust later for a bitmask: Pack into a single integer (e.g., 0b101 = sex=1, lethal=0, vigor=1).
+    @classmethod
+    def reserve_ids(cls, count):
+        """Hand out a block of consecutive fly IDs (shared by all engines)."""
+        ids = np.arange(cls._next_id, cls._next_id + count, dtype=np.int64)
+        cls._next_id += count
+        return ids
+
+    def _wildtype_genotype(self, rng=None):
+        # packed equivalent for array populations: genotype.GENOTYPE (loci word + trait)
+        rng = np.random if rng is None else rng
         return {
-            "sex": np.random.choice([0, 1]),                # SEX locus: 0 for male. 1 for female.
+            "sex": int(rng.choice([0, 1])),                # SEX locus: 0 for male. 1 for female.
             "transgenic-lethal": 0 ,  # Sterility locus: 0 for wildtype. 1 for transgenic.
-            "receptivity-vigor": np.random.random()                # Receptivity-vigor locus: float between 1 and 0.  
+            "receptivity-vigor": rng.random()                # Receptivity-vigor locus: float between 1 and 0.  
         }
     
-    def transgenic_male(self):
-        # will be good to adjust later for a bitmask: Pack into a single integer (e.g., 0b101 = sex=1, lethal=0, vigor=1).
+    def transgenic_male(self, rng=None):
+        # packed equivalent for array populations: genotype.GENOTYPE (loci word + trait)
+        rng = np.random if rng is None else rng
         return {
             "sex": 0,                # SEX locus: 0 for male. 1 for female.
             "transgenic-lethal": 1 ,  # Sterility locus: 0 for wildtype. 1 for transgenic.
-            "receptivity-vigor": np.random.random()                # Receptivity-vigor locus: float between 1 and 0.  
+            "receptivity-vigor": rng.random()                # Receptivity-vigor locus: float between 1 and 0.  
         }
 
-    def update(self):
+    def update(self, rng=None):
         """Update age and transition stages at predefined thresholds."""
         self._transition_stage()
-        self._transgenic_lethality()
+        self._transgenic_lethality(rng)
         self.age += 1
 
-    def _transgenic_lethality(self):
+    def _transgenic_lethality(self, rng=None):
         """Kill transgenic-lethal embryos."""
+        rng = np.random if rng is None else rng
         if (self.stage == "egg" and 
             self.genotype["transgenic-lethal"] == 1 and 
-            np.random.random() < 0.97):  # 97% penetrance
+            rng.random() < 0.97):  # 97% penetrance
+            if self.alive:
+                self.cause = "transgenic-lethal"
             self.alive = False
         
     def cull (self):
@@ -121,14 +130,15 @@ class Drosophila:
             male.genotype["sex"] == 0 and  # Ensure male
             new_receptivity+new_vigor > self.mating_threshold):
             self.fecund = True
-            self.spermatheque.append(male.genotype)            # append at tail, pop for oviposition
-            self.spermatheque.pop()
+            self.spermatheque.append(male.genotype)            # append at tail, last male fathers the eggs
+            self.mates.append(male.id)
 
-    def oviposition(self):
+    def oviposition(self, rng=None):
         ''' Female exclusive trait'''
         # Lay one egg using the last male's genotype (Mendelian inheritance with mutation)
         if not self.spermatheque or not self.fecund:
             return None
+        rng = np.random if rng is None else rng
         
         # Get parental genotypes
         male_genotype = self.spermatheque[-1]  # Last mating partner
@@ -136,47 +146,18 @@ class Drosophila:
         
         # Mendelian inheritance with possible mutation
         offspring_genotype = {
-            "sex": np.random.choice([0, 1]),  # Random sex determination
+            "sex": int(rng.choice([0, 1])),  # Random sex determination
             "transgenic-lethal": male_genotype["transgenic-lethal"],
             "receptivity-vigor": self._inherit_allele(female_genotype["receptivity-vigor"],
-                                        male_genotype["receptivity-vigor"])
+                                        male_genotype["receptivity-vigor"], rng=rng)
         }
         return offspring_genotype
 
-    def _inherit_allele(self, mother_allele, father_allele, mutation_rate=0.001):
+    def _inherit_allele(self, mother_allele, father_allele, mutation_rate=0.001, rng=None):
         """Randomly choose one parental allele with possible mutation."""
-        allele = np.random.choice([mother_allele, father_allele])
-        return allele # if np.random.random() > mutation_rate else 1 - allele
-
-class PopulationMaintenance:
-    def __init__(self):
-        self.report_data = {
-            'date': [],
-            'N': [],
-            'genotype_freqs': [],  # Dict: {genotype_hash: count}
-            'mating_events': [],
-            'age_dist': []  # Binned ages
-        }
-    
-    def record(self, experiment_population, date):
-        adults = [f for f in experiment_population if f.stage == 'adult']
-        self.daily_data['date'].append(date)
-        self.daily_data['N'].append(len(adults))
-        
-        # Genotype frequency (using hash for dictionary keys)
-        freqs = {}
-        for ind in adults:
-            ghash = hash(frozenset(ind.genotype.items()))
-            freqs[ghash] = freqs.get(ghash, 0) + 1
-        self.daily_data['genotype_freqs'].append(freqs)
-        
-        # Mating stats
-        mated = sum(1 for f in adults if f.sex==1 and f.mates)   # sex is not handled properly
-        self.daily_data['mating_events'].append(mated)
-        
-        # Age distribution (10-day bins)
-        self.daily_data['age_dist'].append(
-            np.histogram([f.age for f in adults], bins=range(0,100,10))[0])
+        rng = np.random if rng is None else rng
+        allele = rng.choice([mother_allele, father_allele])
+        return allele # if rng.random() > mutation_rate else 1 - allele
 
 class Experiment:
     def __init__(self,
@@ -187,37 +168,97 @@ class Experiment:
                 release_dates = None, 
                 release_sizes = None,
                 food_init_dates = None,
-                food_shelf_life = None):
+                food_shelf_life = None,
+                engine = "objects",
+                mating_threshold = 1.0,
+                multiple_mating = False,
+                last_male_precedence = True,
+                morgue_path = None,
+                archive_all_deaths = False,
+                seed = None,
+                vigor_bins = 10,
+                instrument = None,
+                genetics = None):
         # begin setup
         self.day = 0
+        # independent random streams per subsystem, all derived from seed
+        self.rng = RandomStreams(seed)
         self.p_daily = p_daily
         self.clutch_size = clutch_size
         self.consumption_rate = consumption_rate
+        self.mating_threshold = mating_threshold
+        # mating system: can fecund females remate, and whose sperm is used
+        self.multiple_mating = multiple_mating
+        self.last_male_precedence = last_male_precedence
+        self.mating_count = 0
+        # running event totals, read by the instrumentation
+        self.eggs_laid = 0
+        self.cull_count = 0
+        # opt-in per-phase timers, counters and observers (instrument.py)
+        if instrument is True:
+            instrument = Instrumentation()
+        self.instruments = instrument or None
+        # opt-in streaming allele frequencies and Ne (genetics.py)
+        if genetics is True:
+            genetics = GeneticsTracker()
+        self.genetics = genetics or None
+        # population backend: "objects" keeps Drosophila instances in lists,
+        # "arrays" keeps one NumPy column per attribute (see population.py),
+        # "cohort" only keeps counts per age x genotype class (see cohort.py)
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}.")
+        self.engine = engine
         # global populations, alive and dead
-        self.population = []
-        self.morgue = []
+        if self.engine == "arrays":
+            self.population = FlyArrays()
+            self.morgue = FlyArrays()
+        elif self.engine == "cohort":
+            self.population = FlyCohorts(vigor_bins)
+            self.morgue = []        # no individual records to keep
+        else:
+            self.population = []
+            self.morgue = []
+            self._counts = PopulationCounts()
+        # optionally stream the morgue to disk instead of keeping it in memory
+        if morgue_path is not None:
+            if self.engine == "cohort":
+                raise ValueError("The cohort engine keeps no individual death records.")
+            self.morgue = MorgueArchive(morgue_path)
+        self.archive_all_deaths = archive_all_deaths
+        # ID -> fly lookups for the object engine, kept in step with
+        # self.population (living flies) and self.morgue (dead adults)
+        self.fly_index = {}
+        # living pre-adults per food cup for the object engine, kept like
+        # PopulationCounts so cup depletion never rescans cup members
+        self.cup_counts = {}
+        self.morgue_index = {}
         # handling of food
         self.food_schedule = []     # a list of dates for cups to arrive
-        # lists of foodcups
-        self.active_food_cups = []
-        self.spent_food_cups = [] 
+        self.cup_scheduler = CupScheduler(fly_daily_rate = self.consumption_rate)
         # data logging
-        self.daily_data = []  # Store daily logs: [day, total, males, females]
+        self.daily_data = []  # Store daily logs: [day, total, males, females, adult mortality]
+        if self.genetics is not None:
+            self.genetics.attach(self)
         
         # initialize population
-        for _ in range(pop_size):
-            self.population.append(Drosophila(bday = self.day, age = 12))  # always initialize with adults
+        if self.engine == "arrays":
+            loci, trait = GENOTYPE.wildtype(pop_size, rng=self.rng.genetics)
+            self.population.add(Drosophila.reserve_ids(pop_size),
+                                bday=self.day,
+                                age=12,     # always initialize with adults
+                                loci=loci,
+                                trait=trait)
+        elif self.engine == "cohort":
+            loci, trait = GENOTYPE.wildtype(pop_size, rng=self.rng.genetics)
+            self.population.add_adults(GENOTYPE.get(loci, "sex"), 0, trait)
+        else:
+            for _ in range(pop_size):
+                self.add_fly(Drosophila(bday = self.day, age = 12,  # always initialize with adults
+                                        mating_threshold = self.mating_threshold,
+                                        rng = self.rng.genetics))
 
         if release_dates is not None:
-            # check for inconsistencies
-            if release_sizes is None:
-                raise ValueError("Both release_dates and release_sizes must be provided if one is given.")
-            
-            if len(release_dates) != len(release_sizes):
-                raise ValueError("release_dates and release_sizes must be of the same length.")
-                
-            # Store release schedule (day: size)
-            self.release_schedule = dict(zip(release_dates, release_sizes))
+            self.set_release_schedule(release_dates, release_sizes)
 
         # Initialize food schedule
         if food_init_dates is not None:
@@ -228,64 +269,302 @@ class Experiment:
             
             # Store food events as tuples: (start_day, end_day, size)
             self.food_schedule = list(zip(food_init_dates, food_shelf_life))
-            
-            # Add initial food cups (if any start on day 0)
-            #for start, _  in self.food_schedule:
-            #    if start == 0:
-            #        self.active_food_cups.append(FoodCup(creation_day=0))
+            for start, shelf_life in self.food_schedule:
+                self.cup_scheduler.schedule(start, shelf_life)
     
+    def set_release_schedule(self, release_dates, release_sizes):
+        # check for inconsistencies
+        if release_dates is None or release_sizes is None:
+            raise ValueError("Both release_dates and release_sizes must be provided if one is given.")
+
+        if len(release_dates) != len(release_sizes):
+            raise ValueError("release_dates and release_sizes must be of the same length.")
+
+        # Store release schedule (day: size)
+        self.release_schedule = dict(zip(release_dates, release_sizes))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # fly IDs are handed out by a class counter, keep it with the experiment
+        state["_next_id"] = Drosophila._next_id
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        # never hand out an ID twice within this process
+        Drosophila._next_id = max(Drosophila._next_id, state.pop("_next_id"))
+        self.__dict__.update(state)
+
+    def snapshot(self):
+        """Full experiment state (population, cups, schedules, RNG, logs) as bytes."""
+        if isinstance(self.morgue, MorgueArchive):
+            self.morgue.flush()
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save_checkpoint(self, path):
+        with open(path, "wb") as file:
+            file.write(self.snapshot())
+
+    @classmethod
+    def restore(cls, snapshot, seed=None, release_dates=None, release_sizes=None, morgue_path=None):
+        ''' Experiment from snapshot() bytes. Without seed it continues the
+        same random streams, so runs branched from one snapshot share
+        common random numbers; release_dates/release_sizes replace the
+        release schedule. Instrumentation observers are not restored, add
+        them again. An on-disk morgue needs its own morgue_path: the
+        records written at snapshot time are copied there and the restored
+        run continues in that file, never in the parent's.'''
+        if (release_dates is None) != (release_sizes is None):
+            raise ValueError("Both release_dates and release_sizes must be provided if one is given.")
+        experiment = pickle.loads(snapshot)
+        if isinstance(experiment.morgue, MorgueArchive):
+            if morgue_path is None or os.path.abspath(morgue_path) == os.path.abspath(experiment.morgue.path):
+                raise ValueError("Restoring an on-disk morgue needs a distinct morgue_path.")
+        if seed is not None:
+            experiment.rng = RandomStreams(seed)
+        if release_dates is not None or release_sizes is not None:
+            experiment.set_release_schedule(release_dates, release_sizes)
+        if isinstance(experiment.morgue, MorgueArchive):
+            experiment.morgue.rewind(morgue_path)
+        return experiment
+
+    @classmethod
+    def load_checkpoint(cls, path, **kwargs):
+        with open(path, "rb") as file:
+            return cls.restore(file.read(), **kwargs)
+
+    def fork(self, seed=None, release_dates=None, release_sizes=None, morgue_path=None):
+        ''' Independent copy of the experiment in its current state, e.g. a
+        release scenario branching from a burn-in; with an on-disk morgue
+        every fork needs its own morgue_path. For many branches take one
+        snapshot() and restore() it once per branch. Instrumentation
+        observers carry over to the fork (snapshots leave them out).'''
+        forked = Experiment.restore(self.snapshot(), seed=seed, release_dates=release_dates,
+                                    release_sizes=release_sizes, morgue_path=morgue_path)
+        if self.instruments is not None:
+            forked.instruments.observers = list(self.instruments.observers)
+        return forked
+
     def update_day(self):
+        # phase timer of the instrumentation, a no-op when not instrumented
+        instruments = self.instruments
+        if instruments is not None:
+            instruments.start_day(self)
+            lap = instruments.lap
+        else:
+            lap = no_lap
         ''' update flies'''
         # update flies in population
-        for fly in self.population:
-            # update emerged flies and egg, larvae in active cups
-            #if fly.age > 10 or fly.id in self.active_food_cups:
-            fly.update()
+        self.age_population()
+        lap("aging")
         # mortality round
         self.mortality_round()
+        lap("mortality")
         ''' update cups'''
-        for start, shelf_life  in self.food_schedule:
-            # update cups, deplete if time is true
-            if len(self.active_food_cups) > 0:
-                for cup in self.active_food_cups:
-                    cup.deplete()
-                    # retire cup if it has expired or spent
-                    if self.day == cup.creation_day + shelf_life or cup.spent == True:
-                        spent_cup = self.active_food_cups.pop()
-                        self.spent_food_cups.append(spent_cup)
-                        # cull flies on spent cup
-                        for fly_id in spent_cup.flies_ID:
-                            for fly in self.population:
-                                if (fly.id == fly_id and fly.age < 10):
-                                    fly.alive = False  # Mark for removal
-                                    break  # Exit inner loop once found
-                    
-            # add a cup if on schedule
-            if start == self.day:
-                self.active_food_cups.append(FoodCup(creation_day=self.day, fly_daily_rate = self.consumption_rate))
-        
+        self.update_cups()
+        lap("cups")
         '''move dead flies to morgue'''
-        daily_mortality = [fly for fly in self.population if not fly.alive]
-        daily_adult_mortality = [fly for fly in self.population if not fly.alive and fly.age > 9]
-        daily_mortality_census = len(daily_adult_mortality)
-        self.morgue.extend(daily_adult_mortality)
-
-        # clear experimental population for alive flies only
-        self.population = [fly for fly in self.population if fly.alive]
+        daily_mortality_census = self.collect_dead()
+        lap("collect")
 
         #### on this stage the flies alive should remain and the rest should be on the morgue
         
         ''' release transgenic males'''
         # Check if a release is scheduled for the current day
         if hasattr(self, 'release_schedule') and self.day in self.release_schedule:
-            for _ in range(self.release_schedule[self.day]):
-                self.population.append(Drosophila(bday = self.day,
-                                                  stage="adult", 
-                                                  genotype={"sex":1, 
-                                                            "transgenic-lethal": 1, 
-                                                            "receptivity-vigor": np.random.random()}))
+            self.add_transgenic_males(self.release_schedule[self.day])
+        lap("release")
 
         ''' cross cycle'''
+        self.cross_cycle()
+        lap("mating")
+        ''' oviposition cycle'''
+        self.oviposition_cycle()
+        lap("oviposition")
+
+        '''complete day'''
+        self.log_data(daily_mortality_census)  # Record data before incrementing day
+        if self.genetics is not None:
+            self.genetics.end_day(self)
+        lap("logging")
+        ''' documentation cycle'''
+        if instruments is not None:
+            instruments.end_day(self)
+        self.day += 1
+
+    def age_population(self):
+        if self.engine != "objects":
+            self.population.update(rng=self.rng.mortality)
+            return
+        for fly in self.population:
+            # update emerged flies and egg, larvae in active cups
+            #if fly.age > 10 or fly.id in self.active_food_cups:
+            stage = fly.stage
+            fly.update(self.rng.mortality)
+            if fly.stage != stage:
+                self._count_fly(fly, -1, stage)
+                self._count_fly(fly, 1)
+            # left the cup by emerging or by transgenic lethality
+            if fly.cup is not None and stage != "adult" and (fly.stage == "adult" or not fly.alive):
+                self._count_cup(fly, -1)
+
+    def mortality_round(self):
+        if self.engine != "objects":
+            self.population.mortality_round(self.p_daily, rng=self.rng.mortality)
+            return
+        draws = self.rng.mortality.random(len(self.population))
+        for fly, draw in zip(self.population, draws):
+            if fly.alive:
+                # Check if the fly dies today based on age-independent probability
+                if draw < self.p_daily:
+                    fly.alive = False
+                    fly.cause = "mortality"
+                    if fly.cup is not None and fly.stage != "adult":
+                        self._count_cup(fly, -1)
+
+    @property
+    def active_food_cups(self):
+        return self.cup_scheduler.active
+
+    @property
+    def spent_food_cups(self):
+        return self.cup_scheduler.spent
+
+    def update_cups(self):
+        # deplete, retire expired or spent cups, add the cups arriving today
+        for spent_cup in self.cup_scheduler.advance(self.day, self.cup_occupancy()):
+            # cull flies on spent cup
+            self.cull_count += self.cull_cup(spent_cup)
+
+    def cup_occupancy(self):
+        """Living pre-adults per active food cup, {cup_id: count}."""
+        if self.engine != "objects":
+            return self.population.cup_occupancy()
+        return self.cup_counts
+
+    def _count_cup(self, fly, n):
+        count = self.cup_counts.get(fly.cup, 0) + n
+        if count:
+            self.cup_counts[fly.cup] = count
+        else:
+            del self.cup_counts[fly.cup]
+
+    def cull_cup(self, spent_cup):
+        """Kill eggs and larvae still developing on a retired cup. Returns the number culled."""
+        if self.engine != "objects":
+            return self.population.cull_cup(spent_cup.cup_id)
+        culled = 0
+        for fly in self.cup_occupants(spent_cup):
+            if fly.age < 10:
+                if fly.alive:
+                    fly.cause = "culled"
+                    culled += 1
+                    self._count_cup(fly, -1)
+                fly.alive = False  # Mark for removal
+        return culled
+
+    @property
+    def counts(self):
+        """Running PopulationCounts of the living population."""
+        if self.engine != "objects":
+            return self.population.counts
+        return self._counts
+
+    def _count_fly(self, fly, n, stage=None):
+        self._counts.add(STAGE_CODES[stage or fly.stage],
+                         fly.genotype["sex"],
+                         fly.genotype["transgenic-lethal"],
+                         n)
+        if self.genetics is not None:
+            self.genetics.add(STAGE_CODES[stage or fly.stage],
+                              fly.genotype["sex"],
+                              fly.genotype["transgenic-lethal"],
+                              fly.genotype["receptivity-vigor"],
+                              n)
+
+    def add_fly(self, fly):
+        """Add a living Drosophila to the population and its ID index."""
+        self.population.append(fly)
+        self.fly_index[fly.id] = fly
+        self._count_fly(fly, 1)
+        if fly.cup is not None and fly.stage != "adult":
+            self._count_cup(fly, 1)
+
+    def find_fly(self, fly_id):
+        ''' Living fly or dead adult with this ID, None if unknown or a dead
+        pre-adult. The object engine returns the Drosophila; the arrays
+        engine returns (table, row) with table the population or the
+        morgue FlyArrays, read e.g. as table["motherID"][row]. Dead flies
+        streamed to a MorgueArchive are looked up in the archive and come
+        back as (records, row) of its memory-mapped records, in both engines.'''
+        if self.engine == "cohort":
+            raise ValueError("The cohort engine keeps no individual flies to look up.")
+        if self.engine == "arrays":
+            row = int(self.population.rows_of([fly_id])[0])
+            if row >= 0:
+                return self.population, row
+        elif fly_id in self.fly_index:
+            return self.fly_index[fly_id]
+        if isinstance(self.morgue, MorgueArchive):
+            records, rows = self.morgue.rows_of([fly_id])
+            return (records, int(rows[0])) if rows[0] >= 0 else None
+        if self.engine == "arrays":
+            row = int(self.morgue.rows_of([fly_id])[0])
+            return (self.morgue, row) if row >= 0 else None
+        return self.morgue_index.get(fly_id)
+
+    def parents(self, fly):
+        ''' (mother, father) of a fly as returned by find_fly, each found
+        with find_fly; None where the parent is founder stock or was not kept.'''
+        if isinstance(fly, tuple):
+            table, row = fly
+            return self.find_fly(int(table["motherID"][row])), self.find_fly(int(table["fatherID"][row]))
+        return self.find_fly(fly.motherID), self.find_fly(fly.fatherID)
+
+    def cup_occupants(self, cup):
+        """Living flies that were laid on a food cup."""
+        return [self.fly_index[fly_id] for fly_id in cup.flies_ID if fly_id in self.fly_index]
+
+    def collect_dead(self):
+        """Move dead adults to the morgue, drop dead flies. Returns adult deaths."""
+        if self.engine == "cohort":
+            return self.population.collect_dead()
+        archive = isinstance(self.morgue, MorgueArchive)
+        if self.engine == "arrays":
+            dead = ~self.population["alive"]
+            dead_adults = dead & (self.population["age"] > 9)
+            if archive:
+                kept = dead if self.archive_all_deaths else dead_adults
+                self.morgue.append(records_from_arrays(self.population, kept, self.day))
+            else:
+                self.morgue.extend(self.population, dead_adults)
+            self.population.compress(~dead)
+            return int(np.count_nonzero(dead_adults))
+        daily_mortality = [fly for fly in self.population if not fly.alive]
+        daily_adult_mortality = [fly for fly in daily_mortality if fly.age > 9]
+        for fly in daily_mortality:
+            fly.dday = self.day
+            del self.fly_index[fly.id]
+            self._count_fly(fly, -1)
+        if archive:
+            kept = daily_mortality if self.archive_all_deaths else daily_adult_mortality
+            self.morgue.append(records_from_flies(kept, self.day))
+        else:
+            self.morgue.extend(daily_adult_mortality)
+            for fly in daily_adult_mortality:
+                self.morgue_index[fly.id] = fly
+
+        # clear experimental population for alive flies only
+        self.population = [fly for fly in self.population if fly.alive]
+        return len(daily_adult_mortality)
+
+    def cross_cycle(self):
+        if self.engine != "objects":
+            self.mating_count += self.population.cross(self.mating_threshold,
+                                                       self.multiple_mating,
+                                                       self.last_male_precedence,
+                                                       rng=self.rng.mating)
+            return
         # mate flies in population
         # separate males from females that are adults
         self.temp_males = [fly for fly in self.population 
@@ -296,78 +575,157 @@ class Experiment:
                             if (fly.genotype["sex"] == 1 
                             and fly.stage == "adult")]
         
-        # round across all females
-        for fem in self.temp_females:
-            if not self.temp_males:
-                break
-            if fem.fecund: # potential multiple mating section
-                break
-            male = self.temp_males[0]
-            fem.cross(male)
-            random.shuffle(self.temp_males)
-        # optional counts in the future
-        # In __init__:
-        # self.mating_count = 0
-        # In cross():
-        # self.mating_count += 1
-        ''' oviposition cycle'''
-        random.shuffle(self.temp_females)
-        if len(self.active_food_cups) > 0:
-            for fem in self.temp_females:
-                # random chance above 0.5 
-                for _ in range(self.clutch_size):
-                    if np.random.random() > 0.5:
-                        embryo_genotype = fem.oviposition()
-                        new_fly = Drosophila(bday = self.day, genotype=embryo_genotype)
-                        self.population.append(new_fly)
-                        random.shuffle(self.active_food_cups)
-                        self.active_food_cups[0].hold(new_fly.id)
+        # one round of random pairing for all females at once
+        candidates = [fem for fem in self.temp_females
+                      if self.multiple_mating or not fem.fecund]
+        if not self.temp_males or not candidates:
+            return
+        partners, success = draw_matings(
+            np.array([fem.genotype["receptivity-vigor"] for fem in candidates], dtype=float),
+            np.array([male.genotype["receptivity-vigor"] for male in self.temp_males], dtype=float),
+            self.mating_threshold,
+            rng=self.rng.mating)
+        for i in np.flatnonzero(success).tolist():
+            candidates[i].cross(self.temp_males[partners[i]])
+        self.mating_count += int(np.count_nonzero(success))
 
-        ''' documentation cycle'''
-        #print(f"pop size: {len(self.population)}")
-        #print(f"morgue size: {len(self.morgue)}")
-        #print(f"End of day: {self.day}")
+    def oviposition_cycle(self):
+        if self.engine == "arrays":
+            self._oviposition_arrays()
+            return
+        if self.engine == "cohort":
+            self._oviposition_cohort()
+            return
+        if len(self.active_food_cups) == 0 or len(self.temp_females) == 0:
+            return
+        females = self.temp_females
+        # genotype of the male whose sperm wins (last or first mate)
+        mated = np.array([bool(fem.fecund and fem.spermatheque) for fem in females])
+        precedence = -1 if self.last_male_precedence else 0
+        sperm = [fem.spermatheque[precedence] if has_sperm else None
+                 for fem, has_sperm in zip(females, mated)]
+        fathers = [fem.mates[precedence] if has_sperm else 0 for fem, has_sperm in zip(females, mated)]
+        mother, loci, trait, cup = draw_clutches(
+            self.clutch_size,
+            GENOTYPE.pack({"sex": 1,
+                           "transgenic-lethal": [fem.genotype["transgenic-lethal"] for fem in females]}),
+            np.array([fem.genotype["receptivity-vigor"] for fem in females], dtype=np.float32),
+            mated,
+            GENOTYPE.pack({"sex": 0,
+                           "transgenic-lethal": [g["transgenic-lethal"] if g else 0 for g in sperm]}),
+            np.array([g["receptivity-vigor"] if g else 0.0 for g in sperm], dtype=np.float32),
+            len(self.active_food_cups),
+            rng=self.rng.oviposition,
+            genetics_rng=self.rng.genetics,
+            cups_rng=self.rng.cups)
+        # bulk creation of the day's cohort
+        for i, m in enumerate(mother.tolist()):
+            new_fly = Drosophila(bday = self.day,
+                                 genotype = GENOTYPE.unpack(loci[i], trait[i]),
+                                 motherID = females[m].id,
+                                 fatherID = fathers[m],
+                                 mating_threshold = self.mating_threshold)
+            new_fly.cup = self.active_food_cups[cup[i]].cup_id
+            self.add_fly(new_fly)
+            self.active_food_cups[cup[i]].hold(new_fly.id)
+        self.eggs_laid += len(mother)
 
-        '''complete day'''
-        self.log_data(daily_mortality_census)  # Record data before incrementing day
-        self.day += 1
+    def _oviposition_arrays(self):
+        if len(self.active_food_cups) == 0:
+            return
+        pop = self.population
+        females = pop.adults(1)
+        mother, loci, trait, cup_choice = draw_clutches(
+            self.clutch_size,
+            pop["loci"][females],
+            pop["trait"][females],
+            pop["fecund"][females],
+            pop["sperm_loci"][females],
+            pop["sperm_trait"][females],
+            len(self.active_food_cups),
+            rng=self.rng.oviposition,
+            genetics_rng=self.rng.genetics,
+            cups_rng=self.rng.cups)
+        n_eggs = len(mother)
+        if n_eggs == 0:
+            return
+        mother_rows = females[mother]
+        ids = Drosophila.reserve_ids(n_eggs)
+        cup_ids = np.array([cup.cup_id for cup in self.active_food_cups], dtype=np.int32)
+        pop.add(ids,
+                bday=self.day,
+                age=0,
+                loci=loci,
+                trait=trait,
+                motherID=pop["id"][mother_rows],
+                fatherID=pop["mateID"][mother_rows],
+                cup=cup_ids[cup_choice])
+        for index, cup in enumerate(self.active_food_cups):
+            cup.hold_many(ids[cup_choice == index].tolist())
+        self.eggs_laid += n_eggs
 
-    def mortality_round(self):
-        for fly in self.population:
-            if fly.alive:
-                # Check if the fly dies today based on age-independent probability
-                if np.random.random() < self.p_daily:
-                    fly.alive = False
+    def _oviposition_cohort(self):
+        if len(self.active_food_cups) == 0:
+            return
+        laid = self.population.lay_eggs(self.clutch_size,
+                                         [cup.cup_id for cup in self.active_food_cups],
+                                         rng=self.rng.oviposition,
+                                         genetics_rng=self.rng.genetics,
+                                         cups_rng=self.rng.cups)
+        for cup, count in zip(self.active_food_cups, laid.tolist()):
+            cup.hold_count(count)
+        self.eggs_laid += int(laid.sum())
 
-    def add_transgenic_males(self, count):
-        """Release transgenic males into the population. PENDING"""
-        transgenic_male_genotype = {
+    def _transgenic_male_genotype(self):
+        return {
             "sex": 0,                # SEX locus: 0 for male. 1 for female.
             "transgenic-lethal": 1 ,  # Sterility locus: 0 for wildtype. 1 for transgenic.
-            "receptivity-vigor": np.random.random()                # Receptivity-vigor locus: float between 1 and 0.  
+            "receptivity-vigor": self.rng.genetics.random()                # Receptivity-vigor locus: float between 1 and 0.  
         }
+
+    def add_transgenic_males(self, count):
+        """Release transgenic adult males into the population."""
+        if self.engine == "arrays":
+            self.population.add(Drosophila.reserve_ids(count),
+                                bday=self.day,
+                                age=12,
+                                loci=GENOTYPE.pack({"sex": 0, "transgenic-lethal": 1}, size=count),
+                                trait=self.rng.genetics.random(count))
+            return
+        if self.engine == "cohort":
+            self.population.add_adults(0, 1, self.rng.genetics.random(count))
+            return
         for _ in range(count):
-            self.population.append(Drosophila(bday = self.day, 
-                                              stage="adult", 
-                                              genotype=transgenic_male_genotype))
+            self.add_fly(Drosophila(bday = self.day, 
+                                    age = 12,
+                                    genotype=self._transgenic_male_genotype(),
+                                    mating_threshold = self.mating_threshold))
     
     def log_data(self, mortality_counts):
         """Record daily population stats (total, males, females)."""
-        adults = [fly for fly in self.population if fly.stage == "adult"]
-        males = sum(1 for fly in adults if fly.genotype["sex"] == 0)
-        females = sum(1 for fly in adults if fly.genotype["sex"] == 1)
-        self.daily_data.append([self.day, len(adults), males, females, mortality_counts])
+        adults, males, females = self.counts.census()
+        self.daily_data.append([self.day, adults, males, females, mortality_counts])
+
+    def census(self):
+        """Current counts by stage plus transgenic adults, read from the running counters."""
+        counts = self.counts
+        report = {stage: counts.stage(code) for stage, code in STAGE_CODES.items()}
+        report["transgenic_adults"] = counts.transgenic_adults()
+        report["total"] = counts.total()
+        return report
     
     def save_to_csv(self, filename="population_data.csv"):
         """Save daily logs to a CSV file."""
         with open(filename, mode='w', newline='') as file:
             writer = csv.writer(file)
-            writer.writerow(["Day", "Total", "Males", "Females"])
+            writer.writerow(["Day", "Adults", "Males", "Females", "Adult mortality"])
             writer.writerows(self.daily_data)
         print(f"Data saved to {filename}")
 
     def plot_population(self):
         """Plot population trends over time."""
+        # imported here so that headless runs and workers never load matplotlib
+        import matplotlib.pyplot as plt
         days = [row[0] for row in self.daily_data]
         total = [row[1] for row in self.daily_data]
         males = [row[2] for row in self.daily_data]
@@ -387,16 +745,21 @@ class Experiment:
         plt.show()
 
     def mortality_census_fit_data(self):
-        # extract the vector of adult mortality
-        mortality_census = [row[4] for row in self.daily_data]
-        # aggregate weekly deaths
-        weekly_mortality_census = []
-        for i in range(0, len(mortality_census), 7):
-            group = mortality_census[i:i+7]          # Extract group of 7 elements
-            weekly_mortality_census.append(sum(group)) # Sum the group
-        # extract the final adult population
-        final_adult_census = [row[1] for row in self.daily_data][-1]
-        # add final population to last mortality count
-        weekly_mortality_census[-1] += final_adult_census
-
-        return weekly_mortality_census
+        return mortality_census_fit_data(self.daily_data)
+
+
+def mortality_census_fit_data(daily_data):
+    """Weekly adult deaths, the final adult census added to the last week."""
+    # extract the vector of adult mortality
+    mortality_census = [row[4] for row in daily_data]
+    # aggregate weekly deaths
+    weekly_mortality_census = []
+    for i in range(0, len(mortality_census), 7):
+        group = mortality_census[i:i+7]          # Extract group of 7 elements
+        weekly_mortality_census.append(sum(group)) # Sum the group
+    # extract the final adult population
+    final_adult_census = [row[1] for row in daily_data][-1]
+    # add final population to last mortality count
+    weekly_mortality_census[-1] += final_adult_census
+
+    return weekly_mortality_census
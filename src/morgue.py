@@ -0,0 +1,208 @@
+import os
+import shutil
+import numpy as np
+from genotype import GENOTYPE
+from population import CAUSES
+
+# one fixed-size little-endian record per dead fly
+RECORD_DTYPE = np.dtype([
+    ("id", "<i8"),
+    ("bday", "<i4"),
+    ("dday", "<i4"),
+    ("loci", "<u4"),          # packed genotype, see genotype.GenotypeLayout
+    ("trait", "<f4"),         # receptivity-vigor allele
+    ("motherID", "<i8"),
+    ("fatherID", "<i8"),
+    ("cause", "i1"),          # index into population.CAUSES
+])
+
+class MorgueArchive:
+    ''' Append-only on-disk morgue. Death records are buffered and written
+    in chunks of RECORD_DTYPE rows to a flat binary file, so memory stays
+    flat however long the run. Running totals (deaths by cause and sex,
+    lifespans) stay in memory; the records themselves are read back
+    lazily with open_archive(), which memory-maps the file.'''
+
+    def __init__(self, path, chunk_size=65536, append=False, layout=GENOTYPE):
+        self.path = path
+        self.layout = layout
+        self._buffer = np.empty(chunk_size, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self._lookup = None         # (count, records, order, sorted ids), see rows_of
+        mode = "ab" if append else "wb"
+        with open(self.path, mode):
+            pass
+        self.count = 0
+        self.by_cause = np.zeros(len(CAUSES), dtype=np.int64)
+        self.by_sex = np.zeros(2, dtype=np.int64)
+        self.lifespan_total = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, records):
+        """Add a structured array of RECORD_DTYPE rows."""
+        records = np.asarray(records, dtype=RECORD_DTYPE)
+        self.count += len(records)
+        self.by_cause += np.bincount(records["cause"], minlength=len(CAUSES))
+        self.by_sex += np.bincount(self.layout.get(records["loci"], "sex"), minlength=2)
+        self.lifespan_total += int((records["dday"] - records["bday"]).sum())
+        while len(records):
+            space = len(self._buffer) - self._buffered
+            taken, records = records[:space], records[space:]
+            self._buffer[self._buffered:self._buffered + len(taken)] = taken
+            self._buffered += len(taken)
+            if self._buffered == len(self._buffer):
+                self.flush()
+
+    def flush(self):
+        if self._buffered == 0:
+            return
+        with open(self.path, "ab") as file:
+            file.write(self._buffer[:self._buffered].tobytes())
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def summary(self):
+        """In-memory totals, available without touching the file."""
+        return {"deaths": self.count,
+                "by_cause": {str(name): int(n) for name, n in zip(CAUSES, self.by_cause) if name},
+                "males": int(self.by_sex[0]),
+                "females": int(self.by_sex[1]),
+                "mean_lifespan": self.lifespan_total / self.count if self.count else None}
+
+    def __getstate__(self):
+        # the buffer is empty after a flush, rebuild it instead of pickling it
+        self.flush()
+        state = self.__dict__.copy()
+        state["_buffer"] = len(self._buffer)
+        state["_lookup"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buffer = np.empty(self._buffer, dtype=RECORD_DTYPE)
+
+    def rewind(self, path=None):
+        ''' Cut the file back to the records counted so far (after restoring
+        a checkpoint), or copy those records to a new file and continue there.'''
+        self.flush()
+        self._lookup = None
+        size = self.count * RECORD_DTYPE.itemsize
+        if path is not None and path != self.path:
+            shutil.copyfile(self.path, path)
+            self.path = path
+        with open(self.path, "r+b") as file:
+            file.truncate(size)
+
+    def read(self):
+        """Flush and memory-map everything written so far."""
+        self.flush()
+        return open_archive(self.path)
+
+    def rows_of(self, ids):
+        ''' (records, rows): the memory-mapped records and the row of each
+        ID in them, -1 where not archived. Records are in death order, so
+        the lookup goes through a sorted copy of the id column, rebuilt on
+        the first lookup after new deaths.'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._lookup is None or self._lookup[0] != self.count:
+            records = self.read()
+            order = np.argsort(records["id"], kind="stable")
+            self._lookup = (self.count, records, order, np.asarray(records["id"])[order])
+        _, records, order, sorted_ids = self._lookup
+        if len(records) == 0:
+            return records, np.full(ids.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(records) - 1)
+        return records, np.where(sorted_ids[positions] == ids, order[positions], -1)
+
+def records_from_arrays(population, mask, dday):
+    """Morgue records for the FlyArrays rows selected by mask."""
+    records = np.empty(int(np.count_nonzero(mask)), dtype=RECORD_DTYPE)
+    for name in ("id", "bday", "loci", "trait", "motherID", "fatherID", "cause"):
+        records[name] = population[name][mask]
+    records["dday"] = dday
+    return records
+
+def records_from_flies(flies, dday, layout=GENOTYPE):
+    """Morgue records for a list of Drosophila objects."""
+    records = np.empty(len(flies), dtype=RECORD_DTYPE)
+    if not flies:
+        return records
+    records["id"] = [fly.id for fly in flies]
+    records["bday"] = [fly.bday for fly in flies]
+    records["dday"] = dday
+    records["loci"] = layout.pack({name: [fly.genotype[name] for fly in flies] for name in layout.loci})
+    records["trait"] = [fly.genotype[layout.trait] for fly in flies]
+    records["motherID"] = [fly.motherID for fly in flies]
+    records["fatherID"] = [fly.fatherID for fly in flies]
+    records["cause"] = [CAUSES.index(fly.cause) for fly in flies]
+    return records
+
+def open_archive(path):
+    """Read-only memory map of a morgue file (empty array for an empty file)."""
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+
+def _archive_path(archive):
+    """Path of a morgue file, flushing a MorgueArchive first so buffered records count."""
+    if isinstance(archive, MorgueArchive):
+        archive.flush()
+        return archive.path
+    return archive
+
+def adult_records(records):
+    ''' Mask of the records of flies that died as adults (age > 9, as in
+    Experiment.collect_dead); founders and released males have no mother
+    and were added as adults.'''
+    return (records["motherID"] == 0) | (records["dday"] - records["bday"] > 9)
+
+def iter_chunks(archive, rows=1_000_000):
+    """Walk a morgue file (path or MorgueArchive) chunk by chunk without loading it."""
+    records = open_archive(_archive_path(archive))
+    for start in range(0, len(records), rows):
+        yield records[start:start + rows]
+
+def offspring_counts(archive, rows=1_000_000, adults_only=False):
+    ''' Number of archived offspring per parent ID, read chunk by chunk
+    from a path or a MorgueArchive (flushed first); with adults_only only
+    offspring that died as adults count.
+    Returns (parent ids, counts); founders (ID 0) are left out.'''
+    totals = {}
+    for chunk in iter_chunks(archive, rows):
+        if adults_only:
+            chunk = chunk[adult_records(chunk)]
+        for column in ("motherID", "fatherID"):
+            ids, counts = np.unique(chunk[column], return_counts=True)
+            for parent, n in zip(ids.tolist(), counts.tolist()):
+                if parent != 0:
+                    totals[parent] = totals.get(parent, 0) + n
+    parents = np.fromiter(totals.keys(), dtype=np.int64, count=len(totals))
+    counts = np.fromiter(totals.values(), dtype=np.int64, count=len(totals))
+    return parents, counts
+
+def effective_size(archive, rows=1_000_000):
+    ''' Ne from the variance in family size of the archived adults,
+    Ne = (4N - 2) / (Vk + 2) with N the number of adult records and Vk
+    the variance of their adult offspring counts (adults without archived
+    offspring count as 0). Eggs and larvae archived with
+    archive_all_deaths are left out, so both archive modes agree. archive is
+    a path or a MorgueArchive (flushed first, so mid-run calls see
+    every record).'''
+    path = _archive_path(archive)
+    n_parents = 0
+    for chunk in iter_chunks(path, rows):
+        n_parents += int(np.count_nonzero(adult_records(chunk)))
+    if n_parents < 2:
+        return None
+    parents, counts = offspring_counts(path, rows, adults_only=True)
+    archived = np.zeros(len(parents), dtype=bool)
+    for chunk in iter_chunks(path, rows):
+        archived |= np.isin(parents, chunk["id"][adult_records(chunk)])
+    family_sizes = counts[archived].astype(float)
+    mean = family_sizes.sum() / n_parents
+    variance = (family_sizes ** 2).sum() / n_parents - mean ** 2
+    return (4 * n_parents - 2) / (variance + 2)
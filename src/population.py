@@ -0,0 +1,364 @@
+import numpy as np
+from genotype import GENOTYPE
+
+# stage codes, index into STAGES for the names used by Drosophila.stage
+EGG, LARVA, IMMATURE, ADULT = 0, 1, 2, 3
+STAGES = ("egg", "larva", "immature", "adult")
+STAGE_CODES = {name: code for code, name in enumerate(STAGES)}
+# cause of death codes, index into CAUSES for the names used by Drosophila.cause
+ALIVE, MORTALITY, LETHALITY, CULLED = 0, 1, 2, 3
+CAUSES = (None, "mortality", "transgenic-lethal", "culled")
+
+class PopulationCounts:
+    ''' Running fly counts by stage x sex x transgenic status, updated on
+    every birth, stage transition, death and release so that daily
+    reporters never rescan the population.'''
+
+    def __init__(self):
+        self.counts = np.zeros((len(STAGES), 2, 2), dtype=np.int64)
+
+    def add(self, stage, sex, lethal, n=1):
+        self.counts[stage, sex, lethal] += n
+
+    def add_many(self, stage, sex, lethal, sign=1):
+        """Count (or with sign=-1 discount) a cohort given as code arrays."""
+        cells = (np.asarray(stage, dtype=np.int64) * 2 + sex) * 2 + lethal
+        self.counts += sign * np.bincount(cells, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def move_many(self, old_stage, new_stage, sex, lethal):
+        self.add_many(old_stage, sex, lethal, sign=-1)
+        self.add_many(new_stage, sex, lethal)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def stage(self, stage):
+        return int(self.counts[stage].sum())
+
+    def census(self):
+        ''' Adult totals: (adults, males, females).'''
+        males, females = self.counts[ADULT].sum(axis=1).tolist()
+        return males + females, males, females
+
+    def transgenic_adults(self):
+        return int(self.counts[ADULT, :, 1].sum())
+
+
+class FlyArrays:
+    ''' Struct-of-arrays population: one NumPy column per fly attribute.
+    Row i of every column describes the same fly, rows keep insertion order
+    (same order as the Experiment.population list of the object model).'''
+
+    COLUMNS = {
+        "id": np.int64,
+        "bday": np.int32,
+        "age": np.int32,
+        "stage": np.int8,
+        "loci": np.uint32,          # packed discrete loci, see genotype.GenotypeLayout
+        "trait": np.float32,        # receptivity-vigor allele
+        "alive": np.bool_,
+        "cause": np.int8,           # cause of death code, ALIVE while alive
+        "fecund": np.bool_,
+        "motherID": np.int64,
+        "fatherID": np.int64,
+        "cup": np.int32,            # food cup holding the fly, -1 for none
+        "cage": np.int16,           # cage of the fly in a Metapopulation, 0 otherwise
+        # spermatheque of females: last mate and his genotype
+        "mateID": np.int64,
+        "sperm_loci": np.uint32,
+        "sperm_trait": np.float32,
+        "matings": np.int16,        # successful matings of a female
+    }
+
+    def __init__(self, capacity=1024, layout=GENOTYPE):
+        self.n = 0
+        self.layout = layout
+        self.counts = PopulationCounts()
+        self.genetics = None        # optional genetics.GeneticsTracker, fed like counts
+        self._ids_sorted = True     # rows in ID order, see rows_of
+        self._id_index = None       # (order, sorted ids) when they are not
+        self._data = {name: np.zeros(capacity, dtype=dtype)
+                      for name, dtype in self.COLUMNS.items()}
+
+    def __len__(self):
+        return self.n
+
+    def __getstate__(self):
+        # only the live rows, spare capacity is regrown on demand
+        state = self.__dict__.copy()
+        state["_data"] = {name: column[:self.n].copy() for name, column in self._data.items()}
+        return state
+
+    def __getitem__(self, name):
+        ''' View of the live part of a column.'''
+        return self._data[name][:self.n]
+
+    def locus(self, name):
+        """Unpacked values of one genotype locus (a copy, not a view)."""
+        return self.layout.get(self["loci"], name)
+
+    @property
+    def nbytes_per_fly(self):
+        return sum(np.dtype(dtype).itemsize for dtype in self.COLUMNS.values())
+
+    @property
+    def capacity(self):
+        return len(self._data["id"])
+
+    def _reserve(self, extra):
+        needed = self.n + extra
+        if needed <= self.capacity:
+            return
+        new_capacity = max(needed, 2 * self.capacity)
+        for name, column in self._data.items():
+            grown = np.zeros(new_capacity, dtype=column.dtype)
+            grown[:self.n] = column[:self.n]
+            self._data[name] = grown
+
+    def add(self, ids, bday, age, loci, trait,
+            motherID=0, fatherID=0, cup=-1, cage=0):
+        ''' Append a cohort of live flies, scalars are broadcast to the cohort.'''
+        ids = np.asarray(ids, dtype=np.int64)
+        count = len(ids)
+        if count == 0:
+            return
+        self._reserve(count)
+        rows = slice(self.n, self.n + count)
+        age = np.broadcast_to(np.asarray(age, dtype=np.int32), (count,))
+        self._data["id"][rows] = ids
+        self._data["bday"][rows] = bday
+        self._data["age"][rows] = age
+        self._data["stage"][rows] = stage_for_age(age)
+        self._data["loci"][rows] = loci
+        self._data["trait"][rows] = trait
+        self._data["alive"][rows] = True
+        self._data["cause"][rows] = ALIVE
+        self._data["fecund"][rows] = False
+        self._data["motherID"][rows] = motherID
+        self._data["fatherID"][rows] = fatherID
+        self._data["cup"][rows] = cup
+        self._data["cage"][rows] = cage
+        self._data["mateID"][rows] = 0
+        self._data["sperm_loci"][rows] = 0
+        self._data["sperm_trait"][rows] = 0.0
+        self._data["matings"][rows] = 0
+        self.n += count
+        self._appended(rows)
+        self._count(rows)
+
+    def extend(self, other, mask=None):
+        ''' Append rows of another FlyArrays (optionally only where mask).'''
+        count = len(other) if mask is None else int(np.count_nonzero(mask))
+        if count == 0:
+            return
+        self._reserve(count)
+        rows = slice(self.n, self.n + count)
+        for name in self.COLUMNS:
+            values = other[name] if mask is None else other[name][mask]
+            self._data[name][rows] = values
+        self.n += count
+        self._appended(rows)
+        self._count(rows)
+
+    def _appended(self, rows):
+        """Keep track of whether the id column is still sorted after an append."""
+        ids = self._data["id"][rows]
+        if self._ids_sorted:
+            previous = self._data["id"][rows.start - 1] if rows.start else ids[0]
+            self._ids_sorted = bool(previous <= ids[0] and np.all(ids[1:] >= ids[:-1]))
+        self._id_index = None
+
+    def _count(self, rows, sign=1):
+        loci = self._data["loci"][rows]
+        stage = self._data["stage"][rows]
+        sex = self.layout.get(loci, "sex")
+        lethal = self.layout.get(loci, "transgenic-lethal")
+        self.counts.add_many(stage, sex, lethal, sign)
+        if self.genetics is not None:
+            self.genetics.add_many(stage, sex, lethal, self._data["trait"][rows], sign)
+
+    def compress(self, mask):
+        ''' Keep only rows where mask is True, preserving order.'''
+        kept = np.flatnonzero(mask)
+        self._count(np.flatnonzero(~mask), sign=-1)
+        for name, column in self._data.items():
+            # rows only move towards the front, so taking in place is safe
+            column[:len(kept)] = column.take(kept)
+        self.n = len(kept)
+        self._id_index = None
+
+    def rows_of(self, ids):
+        ''' Row indices of flies by ID, -1 where not found.
+        IDs are handed out in increasing order and the living population
+        keeps insertion order, so its id column is sorted and a binary
+        search suffices. Tables filled out of ID order (the morgue, rows in
+        death order) are searched through a sorted index, rebuilt on the
+        first lookup after rows were added.'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.n == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        if self._ids_sorted:
+            order, column = None, self["id"]
+        else:
+            if self._id_index is None:
+                order = np.argsort(self["id"], kind="stable")
+                self._id_index = (order, self["id"][order])
+            order, column = self._id_index
+        positions = np.minimum(np.searchsorted(column, ids), self.n - 1)
+        found = column[positions] == ids
+        rows = positions if order is None else order[positions]
+        return np.where(found, rows, -1)
+
+    def update(self, rng=None):
+        ''' Vectorized Drosophila.update: stage transition, lethality, aging.'''
+        rng = np.random.default_rng() if rng is None else rng
+        age = self["age"]
+        stage = self["stage"]
+        # one transition per day at most, as in Drosophila._transition_stage
+        to_larva = (stage == EGG) & (age >= 1)
+        to_immature = (stage == LARVA) & (age >= 10)
+        to_adult = (stage == IMMATURE) & (age >= 12)
+        moving = np.flatnonzero(to_larva | to_immature | to_adult)
+        self._count(moving, sign=-1)
+        stage[to_larva] = LARVA
+        stage[to_immature] = IMMATURE
+        stage[to_adult] = ADULT
+        self._count(moving)
+        # transgenic-lethal embryos, 97% penetrance
+        doomed = (stage == EGG) & (self.locus("transgenic-lethal") == 1)
+        doomed &= rng.random(self.n) < 0.97
+        self._kill(doomed, LETHALITY)
+        age += 1
+
+    def _kill(self, doomed, cause):
+        """Mark flies dead, keeping the first cause for flies killed twice."""
+        self["cause"][doomed & self["alive"]] = cause
+        self["alive"][doomed] = False
+
+    def mortality_round(self, p_daily, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        self._kill(rng.random(self.n) < p_daily, MORTALITY)
+
+    def cull_cup(self, cup_id):
+        ''' Kill the pre-adults held on a retired food cup. Returns the number culled.'''
+        doomed = (self["cup"] == cup_id) & (self["age"] < 10)
+        culled = int(np.count_nonzero(doomed & self["alive"]))
+        self._kill(doomed, CULLED)
+        return culled
+
+    def cup_occupancy(self):
+        """Living pre-adults per food cup, {cup_id: count}."""
+        on_cup = self["alive"] & (self["stage"] != ADULT) & (self["cup"] >= 0)
+        cups, counts = np.unique(self["cup"][on_cup], return_counts=True)
+        return dict(zip(cups.tolist(), counts.tolist()))
+
+    def adults(self, sex):
+        ''' Row indices of adults of one sex, in population order.'''
+        return np.flatnonzero((self["stage"] == ADULT) & (self.locus("sex") == sex))
+
+    def cross(self, mating_threshold=1.0, multiple_mating=False, last_male_precedence=True, rng=None,
+              group=None):
+        ''' One day of mating for the whole population, see draw_matings.
+        Unless multiple_mating, only females that are not yet fecund take
+        part. The spermatheque columns keep the last mate's genotype, or
+        the first one's when last_male_precedence is False. With group (a
+        column name, e.g. "cage") females only meet males of their own
+        group, and mating_threshold can be an array indexed by group.
+        Returns the number of successful matings.'''
+        males = self.adults(0)
+        females = self.adults(1)
+        if not multiple_mating:
+            females = females[~self["fecund"][females]]
+        if len(males) == 0 or len(females) == 0:
+            return 0
+        vigor = self["trait"]
+        if group is None:
+            partners, success = draw_matings(vigor[females], vigor[males], mating_threshold, rng=rng)
+        else:
+            female_group = self[group][females]
+            if np.ndim(mating_threshold) > 0:
+                mating_threshold = np.asarray(mating_threshold)[female_group]
+            partners, success = draw_matings(vigor[females], vigor[males], mating_threshold, rng=rng,
+                                             female_group=female_group, male_group=self[group][males])
+        mated, fathers = females[success], males[partners[success]]
+        self["matings"][mated] += 1
+        if not last_male_precedence:
+            first = ~self["fecund"][mated]
+            mated, fathers = mated[first], fathers[first]
+        self["fecund"][mated] = True
+        self["mateID"][mated] = self["id"][fathers]
+        self["sperm_loci"][mated] = self["loci"][fathers]
+        self["sperm_trait"][mated] = vigor[fathers]
+        return int(np.count_nonzero(success))
+
+    def census(self):
+        ''' Adult totals: (adults, males, females).'''
+        return self.counts.census()
+
+
+def draw_matings(female_vigor, male_vigor, mating_threshold=1.0, rng=None,
+                 female_group=None, male_group=None):
+    ''' Random pairing for a whole day: every female meets one male drawn
+    uniformly (males can meet several females) and mates when her
+    receptivity plus his vigor exceeds the threshold (Drosophila.cross).
+    With female_group/male_group codes (e.g. cages) a female only meets
+    males of her group; females of groups without males do not mate.
+    Returns (partner index into the males, success mask).'''
+    rng = np.random.default_rng() if rng is None else rng
+    if female_group is None:
+        partners = rng.integers(len(male_vigor), size=len(female_vigor))
+        success = female_vigor + male_vigor[partners] > mating_threshold
+        return partners, success
+    female_group = np.asarray(female_group, dtype=np.int64)
+    male_group = np.asarray(male_group, dtype=np.int64)
+    n_groups = int(max(female_group.max(initial=-1), male_group.max(initial=-1))) + 1
+    # males sorted by group, each group a contiguous block
+    order = np.argsort(male_group, kind="stable")
+    per_group = np.bincount(male_group, minlength=n_groups)
+    start = np.cumsum(per_group) - per_group
+    available = per_group[female_group]
+    pick = (rng.random(len(female_vigor)) * available).astype(np.int64)
+    met = available > 0
+    partners = np.full(len(female_vigor), -1, dtype=np.int64)
+    partners[met] = order[start[female_group[met]] + pick[met]]
+    success = met & (female_vigor + male_vigor[partners] > mating_threshold)
+    return partners, success
+
+
+def draw_clutches(clutch_size, mother_loci, mother_trait, mated, sperm_loci, sperm_trait,
+                  n_cups, layout=GENOTYPE, rng=None, genetics_rng=None, cups_rng=None):
+    ''' One day of oviposition for a set of laying females, in a handful of
+    vectorized RNG calls instead of several per egg.
+    Every female gets clutch_size chances of 0.5 to lay. Eggs of mated
+    females inherit from their mother and the stored sperm through
+    layout.inherit (Drosophila.oviposition); eggs of unmated females get a
+    wildtype genotype, as when oviposition() returns None. Returns per-egg
+    arrays (mother, loci, trait, cup) where mother indexes the female
+    arrays and cup indexes the active cups. clutch_size and n_cups can be
+    per-female arrays (e.g. the cups of each female's cage). Clutch sizes,
+    offspring genotypes and cups can each come from their own generator.'''
+    rng = np.random.default_rng() if rng is None else rng
+    genetics_rng = rng if genetics_rng is None else genetics_rng
+    cups_rng = rng if cups_rng is None else cups_rng
+    mated = np.asarray(mated, dtype=bool)
+    eggs = rng.binomial(clutch_size, 0.5, size=len(mated))
+    mother = np.repeat(np.arange(len(mated)), eggs)
+    loci, trait = layout.inherit(mother_loci[mother], sperm_loci[mother],
+                                 mother_trait[mother], sperm_trait[mother], rng=genetics_rng)
+    wildtype = ~mated[mother]
+    loci[wildtype], trait[wildtype] = layout.wildtype(np.count_nonzero(wildtype), rng=genetics_rng)
+    if np.ndim(n_cups) > 0:
+        n_cups = np.asarray(n_cups)[mother]
+    cup = cups_rng.integers(n_cups, size=len(mother))
+    return mother, loci, trait, cup
+
+
+def stage_for_age(age):
+    ''' Stage code for flies created at a given age (see Drosophila.__init__).'''
+    age = np.asarray(age)
+    stage = np.full(age.shape, -1, dtype=np.int8)
+    for code, start in ((EGG, 0), (LARVA, 2), (IMMATURE, 10), (ADULT, 12)):
+        stage[age == start] = code
+    if (stage < 0).any():
+        raise ValueError("Stage provided is not valid.")
+    return stage
@@ -0,0 +1,80 @@
+import argparse
+import json
+import time
+import numpy as np
+from ensemble import run_ensemble
+
+# daily_data columns after the day, as written by Experiment.log_data
+COLUMNS = ("adults", "males", "females", "adult_mortality")
+
+def run_batch(param_sets, days=154, replicates=1, seed=None, processes=None, output=None, **kwargs):
+    ''' Headless batch run: every parameter set (a dict of Experiment
+    keyword arguments, or a list of them) `replicates` times for `days`
+    days over the ensemble process pool. The daily logs of all runs are
+    gathered into one [run, day] array per column, runs ordered by set
+    then replicate, and saved to a single compressed .npz file when an
+    output path is given (see load_batch). kwargs go to run_ensemble.'''
+    if isinstance(param_sets, dict):
+        param_sets = [param_sets]
+    if isinstance(replicates, int):
+        replicates = [replicates] * len(param_sets)
+    offsets = np.concatenate([[0], np.cumsum(replicates)]).astype(int)
+    n_runs = int(offsets[-1])
+    data = np.zeros((n_runs, days, len(COLUMNS)), dtype=np.int32)
+    spawn_keys = [None] * n_runs
+    for result in run_ensemble(param_sets, replicates, days, seed, processes, **kwargs):
+        run = offsets[result["set"]] + result["replicate"]
+        data[run] = np.asarray(result["daily_data"], dtype=np.int32)[:, 1:]
+        spawn_keys[run] = list(result["spawn_key"])
+    batch = {"day": np.arange(days, dtype=np.int32),
+             "set": np.repeat(np.arange(len(param_sets)), replicates),
+             "replicate": np.concatenate([np.arange(count) for count in replicates])}
+    for index, name in enumerate(COLUMNS):
+        batch[name] = data[:, :, index]
+    batch["params"] = np.array(json.dumps(param_sets))
+    batch["seed"] = np.array(json.dumps(seed))
+    batch["spawn_keys"] = np.array(json.dumps(spawn_keys))
+    if output is not None:
+        np.savez_compressed(output, **batch)
+    return batch
+
+def load_batch(path):
+    ''' Read a run_batch() file back: arrays per column plus the decoded
+    parameter sets, seed and per-run seed spawn keys.'''
+    with np.load(path) as file:
+        batch = {name: file[name] for name in file.files}
+    for name in ("params", "seed", "spawn_keys"):
+        batch[name] = json.loads(str(batch[name]))
+    return batch
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run experiment replicates headless and save all daily logs to one .npz file.")
+    parser.add_argument("--config", help="JSON file with Experiment keyword arguments (a dict or a list of dicts)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Experiment keyword argument, value parsed as JSON when possible")
+    parser.add_argument("--days", type=int, default=154)
+    parser.add_argument("--replicates", type=int, default=1)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--output", default="runs.npz")
+    args = parser.parse_args()
+
+    param_sets = [{}]
+    if args.config:
+        with open(args.config) as file:
+            param_sets = json.load(file)
+        if isinstance(param_sets, dict):
+            param_sets = [param_sets]
+    overrides = dict(item.split("=", 1) for item in args.set)
+    param_sets = [dict(params, **{key: _parse_value(value) for key, value in overrides.items()})
+                  for params in param_sets]
+    start = time.time()
+    batch = run_batch(param_sets, args.days, args.replicates, args.seed, args.processes, args.output)
+    print(f"{len(batch['set'])} runs x {args.days} days in {time.time() - start:.1f} s -> {args.output}")